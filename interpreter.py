@@ -5,10 +5,20 @@ import mash_exceptions as mex
 from symbol_table import symb_table, SymbTable
 import ir
 import parsing
+from passes import pass_manager
 import mash_types as types
 from parsing import Parser
 from debugging import info, debug
 from pathlib import Path
+import hashlib
+
+# Spaces of modules imported in the global scope by their resolved paths
+modules = {}
+# Resolved paths and hashes of module files read by the code generation
+sources = {}
+
+def source_hash(code):
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
 
 class Interpreter(Mash):
     """
@@ -57,11 +67,11 @@ class Interpreter(Mash):
         insts = []
         dst = None
         if type(src) == Token:
-            if src.type in Interpreter.CONSTS or type(src.value) == str or type(src.value) == list:
-                dst = src.value
-            elif src.type == "CODE":
+            if src.type == "CODE":
                 insts += src.value
                 dst = insts[-1].dst
+            elif src.type in Interpreter.CONSTS or type(src.value) == str or type(src.value) == list:
+                dst = src.value
             else:
                 raise mex.Unimplemented("Subexpression")
         else:
@@ -100,7 +110,7 @@ class Interpreter(Mash):
                     if not s:
                         raise mex.UndefinedReference(m)
                     cnd = tree.value
-        return (cnd, insts)
+        return (cnd, self.generate_lazy(insts))
 
     def generate_expr(self, root):
         """
@@ -114,27 +124,26 @@ class Interpreter(Mash):
                 lr, left = self.generate_expr(root.children[0])
                 iname = root.data[5:]
                 opres = self.uniq_var()
-                symb_table.assign(opres, None)
                 return (opres, left+[ir.LNot(lr, opres)])
             if root.data == "EXPR_NEG":
                 lr, left = self.generate_expr(root.children[0])
                 iname = root.data[5:]
                 opres = self.uniq_var()
-                symb_table.assign(opres, None)
                 return (opres, left+[ir.Neg(lr, opres)])
             elif root.data == "EXPR_TIF":
                 lr, left = self.generate_expr(root.children[0])
                 mr, mid = self.generate_expr(root.children[1])
                 rr, right = self.generate_expr(root.children[2])
                 opres = self.uniq_var()
-                symb_table.assign(opres, None)
-                return (opres, left+mid+right+[ir.TernaryIf(lr, mr, rr, opres)])
+                if len(mid) > 0 or len(right) > 0:
+                    # Only the taken branch is evaluated
+                    return (opres, left+[ir.LazyTernaryIf(lr, mid, mr, right, rr, opres)])
+                return (opres, left+[ir.TernaryIf(lr, mr, rr, opres)])
             elif len(root.data) > 5 and root.data[0:5] == "EXPR_":
                 lr, left = self.generate_expr(root.children[0])
                 rr, right = self.generate_expr(root.children[1])
                 iname = root.data[5:]
                 opres = self.uniq_var()
-                symb_table.assign(opres, None)
                 if iname == "ADD":
                     return (opres, left+right+[ir.Add(lr, rr, opres)])
                 if iname == "CAT":
@@ -152,13 +161,13 @@ class Interpreter(Mash):
                 elif iname == "EXP":
                     return (opres, left+right+[ir.Exp(lr, rr, opres)])
                 elif iname == "LOR":
-                    return (opres, left+right+[ir.LOr(lr, rr, opres)])
+                    return (opres, left+self.short_circuit(ir.LOr(lr, rr, opres), right, True))
                 elif iname == "LAND":
-                    return (opres, left+right+[ir.LAnd(lr, rr, opres)])
+                    return (opres, left+self.short_circuit(ir.LAnd(lr, rr, opres), right, False))
                 elif iname == "OR":
-                    return (opres, left+right+[ir.Or(lr, rr, opres)])
+                    return (opres, left+self.short_circuit(ir.Or(lr, rr, opres), right, True))
                 elif iname == "AND":
-                    return (opres, left+right+[ir.And(lr, rr, opres)])
+                    return (opres, left+self.short_circuit(ir.And(lr, rr, opres), right, False))
                 elif iname == "LTE":
                     return (opres, left+right+[ir.Lte(lr, rr, opres)])
                 elif iname == "GTE":
@@ -178,12 +187,46 @@ class Interpreter(Mash):
             elif root.data == "fun_call":
                 opres = self.uniq_var()
                 symb_table.assign(SymbTable.RETURN_NAME, None)
-                symb_table.assign(opres, SymbTable.RETURN_NAME)
                 return (opres, self.generate_ir(root, True)+[ir.AssignVar(opres, SymbTable.RETURN_NAME)])
             elif root.data == "member" or root.data == "range" or root.data == "slice":
                 insts = self.generate_ir(root, True)
                 return (insts[-1].dst, insts)
                 
+    def generate_code(self, code, silent=True):
+        """
+        Generates instructions for parse tree nodes left in generated code,
+        including the operands, which are evaluated only when needed
+        """
+        insts = []
+        for i in code:
+            if type(i) == Tree or type(i) == Token:
+                insts += self.generate_ir(i, silent)
+            else:
+                insts.append(i)
+        return self.generate_lazy(insts)
+
+    def generate_lazy(self, insts):
+        """
+        Generates instructions for parse tree nodes in operands, which are
+        evaluated only when needed, the operands are replaced in place
+        """
+        for i in insts:
+            if type(i) == ir.ShortCircuit:
+                i.right = self.generate_code(i.right)
+            elif type(i) == ir.LazyTernaryIf:
+                i.t_insts = self.generate_code(i.t_insts)
+                i.f_insts = self.generate_code(i.f_insts)
+        return insts
+
+    def short_circuit(self, op, right, result):
+        """
+        Skips evaluation of the right operand when the left one
+        is equal to result
+        """
+        if len(right) == 0:
+            return [op]
+        return [ir.ShortCircuit(op, right, result)]
+
     def op_assign(self, dst, value, op):
         """
         Returns correct operation or assignment based on used operator
@@ -230,6 +273,14 @@ class Interpreter(Mash):
         lpath = self.find_module(f_name)
         if lpath is None:
             raise mex.ImportError("No module '"+f_name+"' found on lib path ("+(", ".join(["'"+str(i)+"'" for i in self.opts.lib_path]))+")")
+        # Module is generated only once, other imports only bind its space
+        registered = alias is not None and self.symb_table.in_global()
+        key = lpath.resolve()
+        if registered and key in modules:
+            space = modules[key]
+            if type(scope) == list:
+                return [self.module_alias(alias, [space]+scope[1:])]
+            return [self.module_alias(alias, space)]
         # Reading the file
         try:
             with open(lpath, 'r', encoding='utf-8') as lib_file:
@@ -238,7 +289,7 @@ class Interpreter(Mash):
             raise mex.ImportError("Insufficient permissions to read file '"+str(lpath)+"'")
         except Exception:
             raise mex.ImportError("Could not read module file '"+str(lpath)+"'")
-        
+        sources[f_name] = (key, source_hash(lib_code))
         if alias is not None:
             if type(scope) != list:
                 lib_code = "space "+alias+"{ " + lib_code + "}"
@@ -251,9 +302,74 @@ class Interpreter(Mash):
         interpreter = Interpreter(self.opts, self.symb_table, self.mash_args)
         lib_ir = interpreter.interpret_top_level(parsing.ConstTransformer(self.symb_table).transform(tree))
         if type(scope) == list and alias is not None:
-            lib_ir.append(ir.AssignVar(alias, [sp_name]+scope[1:]))
+            lib_ir.append(self.module_alias(alias, [sp_name]+scope[1:]))
+        if registered:
+            if type(scope) == list:
+                modules[key] = sp_name
+            else:
+                # Name that cannot be accessed by the user, so that it keeps
+                # the space even if the alias is reassigned
+                modules[key] = f"__{scope}{len(modules)}"
+                lib_ir.append(self.module_alias(modules[key], alias))
         return lib_ir
 
+    def module_alias(self, alias, target):
+        """
+        Binds alias to space of imported module or its member
+        """
+        found, _ = self.symb_table.exists(target)
+        if found:
+            self.symb_table.assign(alias, self.symb_table.get(target))
+        return ir.AssignVar(alias, target)
+
+    def import_libmash(self):
+        """
+        Imports libmash. Its ir, symbol table state left by the code generation
+        and lowered code are cached on disk for following runs
+        @return Ir of libmash and its lowered code or None if it was not lowered
+        """
+        lpath = self.find_module("libmash.ms")
+        if lpath is None or self.opts.no_cache:
+            return self.import_module("libmash", None), None
+        try:
+            with open(lpath, 'r', encoding='utf-8') as lib_file:
+                lib_code = lib_file.read()
+        except Exception:
+            return self.import_module("libmash", None), None
+        sources["libmash.ms"] = (lpath.resolve(), source_hash(lib_code))
+        path = parsing.cache_file(lib_code, f"O{pass_manager.level}.ir")
+        cached = parsing.cache_load(path)
+        if cached is not None:
+            lib_ir, state, flat = cached
+            self.symb_table.restore(state)
+            return lib_ir, flat
+        lib_ir = self.import_module("libmash", None)
+        if self.opts.code_only:
+            # Lowering would output passes of libmash
+            return lib_ir, None
+        state = self.symb_table.state()
+        flat = ir.lower_block(lib_ir, program=True)
+        ir.lower_bodies(flat)
+        parsing.cache_store(path, (lib_ir, state, flat))
+        return lib_ir, flat
+
+    def sources_changed(self, files):
+        """
+        @param files Module files read when cached code was generated
+        @return If any of the imports would now read a different or changed file
+        """
+        for f_name, (key, digest) in files.items():
+            lpath = self.find_module(f_name)
+            try:
+                if lpath is None or lpath.resolve() != key:
+                    return True
+                with open(lpath, 'r', encoding='utf-8') as lib_file:
+                    if source_hash(lib_file.read()) != digest:
+                        return True
+            except Exception:
+                return True
+        return False
+
     def generate_fun(self, root):
         insts = []
         tree = root.children
@@ -352,23 +468,14 @@ class Interpreter(Mash):
                 subtree = root.value
                 for i in subtree:
                     if i.type == "CODE":
-                        for code_inst in i.value:
-                            if type(code_inst) == Tree or type(code_inst) == Token:
-                                insts += self.generate_ir(code_inst, True)
-                            else:
-                                insts.append(code_inst)
+                        insts += self.generate_code(i.value)
                     else:
                         if i.type in Interpreter.CONSTS:
                             if not silent:
                                 insts.append(ir.Print(i.value, output_file=self.output_file, output_format=self.output_format))
             # Generated code
             elif root.type == "CODE":
-                insts = []
-                for i in root.value:
-                    if type(i) == Tree or type(i) == Token:
-                        insts += self.generate_ir(i, silent)
-                    else:
-                        insts.append(i)
+                insts = self.generate_code(root.value, silent)
                 if not silent:
                     insts.append(ir.Print(root.value[-1].dst, output_file=self.output_file, output_format=self.output_format))
             # Const print
@@ -389,7 +496,7 @@ class Interpreter(Mash):
                 if root.value[0] == "n":
                     # Note instructions are generated only for main module
                     if self.main:
-                        if len(symb_table.frames) > 1:
+                        if not symb_table.in_global():
                             raise mex.IncorrectDefinition("Notes can appear only on the global scope")
                         # General note
                         insts = [ir.Note(root.value[1], self.output_file, self.output_format, self.output_notes)]
@@ -399,7 +506,7 @@ class Interpreter(Mash):
                 else:
                     # This should have been handeled in the parser
                     raise mex.InternalError(f"Unexpected note prefix '{root.value[0]}'")
-            self.last_inst = insts
+            self.last_inst = self.generate_lazy(insts)
             return insts
         else:
             insts = []
@@ -418,22 +525,14 @@ class Interpreter(Mash):
                     if tree.type in Interpreter.CONSTS:
                         insts.append(self.op_assign(value, tree.value, op))
                     elif tree.type == "CODE":
-                        for code_inst in tree.value:
-                            if type(code_inst) == Tree or type(code_inst) == Token:
-                                insts += self.generate_ir(code_inst, True)
-                            else:
-                                insts.append(code_inst)
+                        insts += self.generate_code(tree.value)
                         last_dst = tree.value[-1].dst
                         insts += [self.op_assign(value, last_dst, op)]
                     elif tree.type == "CALC":
                         subtree = tree.value
                         for i in subtree:
                             if i.type == "CODE":
-                                for code_inst in i.value:
-                                    if type(code_inst) == Tree or type(code_inst) == Token:
-                                        insts += self.generate_ir(code_inst, True)
-                                    else:
-                                        insts.append(code_inst)
+                                insts += self.generate_code(i.value)
                             else:
                                 if i.type in Interpreter.CONSTS:
                                     insts.append(self.op_assign(value, i.value, op))
@@ -764,7 +863,7 @@ class Interpreter(Mash):
                 insts.append(ir.Slice(src, *indices, dst))
                 if not silent:
                     insts.append(ir.Print(dst, output_file=self.output_file, output_format=self.output_format))
-            self.last_inst = insts
+            self.last_inst = self.generate_lazy(insts)
             return insts
         debug("No instructions generated for: {}".format(root), self.opts)
         return []
@@ -791,29 +890,64 @@ class Interpreter(Mash):
                 info(i, self.opts)
         return self.ir
 
-    def interpret(self, code):
+    def compile(self, code, flat=None):
+        """
+        Lowers ir into flat code with jumps and compiles it into closures,
+        so that operand kinds are resolved only once and not on every execution
+        @param code IR code to be compiled
+        @param flat Already lowered code or None
+        @return List of closures for each flat instruction
+        """
+        if flat is None:
+            flat = ir.lower_block(code, program=True)
+        self.registers = ir.register_count(flat)
+        compiled = ir.compile_block(flat)
+        if self.code_blocks is not None and self.output_file is not None:
+            for c, i in enumerate(flat):
+                if type(i) == ir.Note:
+                    compiled[c] = self.note_hook(compiled[c])
+        return compiled
+
+    def note_hook(self, note):
+        """
+        Wraps note so that code block preceding it is written before it
+        """
+        def run():
+            self.write_code_block()
+            note()
+        return run
+
+    def write_code_block(self):
+        if len(self.code_blocks) > 0:
+            with open(self.output_file, "a", encoding="utf-8") as outf:
+                s = self.code_blocks.pop()
+                if len(s) > 0 and not s.isspace():
+                    outf.write("\n```\n"+s.strip()+"\n```\n")
+                    if len(ir.output_print) > 0:
+                        outstdp = "".join(ir.output_print)
+                        outf.write("_[Output]:_\n```\n"+outstdp+"\n```\n")
+                        ir.output_print = []
+        else:
+            raise mex.InternalError("Somehow notes were incorrectly parsed in source code")
+
+    def interpret(self, code, flat=None):
         """
         Interprets passed in ir
         @param code IR code to be interpreted
+        @param flat Already lowered code or None
         """
         self.symb_table.analyzer = False
         if self.output_file is not None:
             with open(self.output_file, "w", encoding="utf-8") as outf:
                 ...
-        for i in code:
-            if self.code_blocks is not None and self.output_file is not None and type(i) == ir.Note:
-                if len(self.code_blocks) > 0:
-                    with open(self.output_file, "a", encoding="utf-8") as outf:
-                        s = self.code_blocks.pop()
-                        if len(s) > 0 and not s.isspace():
-                            outf.write("\n```\n"+s.strip()+"\n```\n")
-                            if len(ir.output_print) > 0:
-                                outstdp = "".join(ir.output_print)
-                                outf.write("_[Output]:_\n```\n"+outstdp+"\n```\n")
-                                ir.output_print = []
-                else:
-                    raise mex.InternalError("Somehow notes were incorrectly parsed in source code")
-            i.exec()
+        compiled = self.compile(code, flat)
+        self.symb_table.regs = [None]*self.registers
+        try:
+            r = run(compiled)
+        except RecursionError:
+            raise mex.RecursionError("Maximum depth of function calls exceeded")
+        if r is not None:
+            raise mex.FlowControlReturn(r[0], r[1])
         if self.code_blocks is not None and len(self.code_blocks) > 0 and self.output_file is not None:
             with open(self.output_file, "a", encoding="utf-8") as outf:
                     outf.write("```\n"+self.code_blocks.pop().strip()+"\n```\n")
@@ -822,6 +956,27 @@ class Interpreter(Mash):
                         outf.write("_[Output]:_\n```\n"+outstdp+"\n```\n")
                         ir.output_print = []
 
+def run(code):
+    """
+    Dispatch loop for compiled flat code.
+    Each instruction returns None to continue with the following one,
+    an index of instruction to jump to or a tuple of returned value
+    and amount of frames to be popped by the caller
+    @param code List of compiled instructions
+    @return Returned value and amount of frames or None
+    """
+    pc = 0
+    end = len(code)
+    while pc < end:
+        n = code[pc]()
+        if n is None:
+            pc += 1
+        elif type(n) == int:
+            pc = n
+        else:
+            return n
+    return None
+
 def format_ir(ir_code):
     for i in ir_code:
         print(i.output())
@@ -831,36 +986,60 @@ def interpret(opts, code, mash_args):
     Interpret mash code
     """
     mash_args = types.List([types.String(a) for a in mash_args])
-    debug("Parser started", opts)
+    pass_manager.level = opts.opt_level
+    symb_table.mash_args = mash_args
+    interpreter = Interpreter(opts, symb_table, mash_args)
     parser = Parser(code, opts)
-    tree = parser.parse(main=True)
+    # Lowered code of the program with its functions is cached with module files it was
+    # generated from, options changing the generated code are part of the key
+    cache = not (opts.no_cache or opts.code_only or opts.parse_only)
+    flat = None
+    if cache:
+        key = repr((opts.output, opts.output_notes, opts.no_libmash, [str(p.resolve()) for p in opts.lib_path]))
+        path = parsing.cache_file(key+"\n"+code, f"O{pass_manager.level}.main")
+        cached = parsing.cache_load(path)
+        if cached is not None and not interpreter.sources_changed(cached[0]):
+            flat = cached[1]
+            debug("Using cached code", opts)
+    if flat is None:
+        debug("Parser started", opts)
+        tree = parser.parse(main=True)
+        debug("Parser finished", opts)
+        if opts.parse_only:
+            return
+    elif opts.output is not None:
+        parser.split_blocks()
     code_blocks = parser.code_blocks[:]
-    debug("Parser finished", opts)
-    if opts.parse_only:
-        return
 
     debug("Code generation started", opts)
-    symb_table.mash_args = mash_args
-    interpreter = Interpreter(opts, symb_table, mash_args)
     if not opts.no_libmash:
         debug("Importing libmash", opts)
-        lib_code = interpreter.import_module("libmash", None)
+        lib_code, lib_flat = interpreter.import_libmash()
         debug("Libmash code generated", opts)
-    ir_parse = parsing.ConstTransformer(symb_table)
-    ir_tree = ir_parse.transform(tree)
-    ir_code = ir_parse.insts
-    interpreter.main = True
-    ir_code += interpreter.interpret_top_level(ir_tree)
-    debug("IR generation done", opts)
-    if opts.code_only:
-        format_ir(ir_code)
-        return
+    ir_code = []
+    if flat is None:
+        ir_parse = parsing.ConstTransformer(symb_table)
+        ir_tree = ir_parse.transform(tree)
+        ir_code = ir_parse.insts
+        interpreter.main = True
+        ir_code += interpreter.interpret_top_level(ir_tree)
+        debug("IR generation done", opts)
+        if opts.code_only:
+            format_ir(ir_code)
+            if pass_manager.level > 0:
+                pass_manager.show = True
+                ir.lower_block(ir_code, program=True)
+            return
+        if cache:
+            flat = ir.lower_block(ir_code, program=True)
+            ir.lower_bodies(flat)
+            parsing.cache_store(path, (dict(sources), flat))
     debug("Running IR", opts)
     symb_table.clear_all()
     if not opts.no_libmash:
-        interpreter.interpret(lib_code)
+        interpreter.interpret(lib_code, lib_flat)
     interpreter.code_blocks = code_blocks
-    interpreter.interpret(ir_code)
+    interpreter.interpret(ir_code, flat)
     interpreter.main = False
     debug("Finished running IR", opts)
     
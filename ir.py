@@ -1,7 +1,10 @@
 from typing import Type
+from copy import copy
+from functools import partial
+import operator
 from symbol_table import symb_table, SymbTable, ClassFrame, Frame, SpaceFrame
 import mash_exceptions as mex
-from mash_types import Float, Int, Nil, Bool, String, Value, List, Dict, VarArgs
+from mash_types import Float, Int, Nil, Bool, String, Value, List, Dict, VarArgs, share
 import mash_types as types
 import libmash
 
@@ -12,6 +15,12 @@ class IR:
     Base class for all ir nodes
     """
     SPCS = "    "
+    # Offsets of frames holding resolved names from the top frame
+    depths = None
+    # Register slots holding temporaries
+    regs = None
+    # Attributes holding read operands, which can be replaced by constants
+    OPERANDS = ()
 
     def getV(self, name):
         if type(name) == str or type(name) == list:
@@ -29,6 +38,56 @@ class IR:
         else:
             raise mex.Unimplemented(f"Getter for IR node type ({name})")
 
+    def getter(self, name):
+        """
+        Returns closure fetching value of name.
+        Kind of the operand is resolved once, at compile time
+        """
+        if type(name) == str or type(name) == list:
+            if self.regs is not None and type(name) == str and name in self.regs:
+                return register_getter(self.regs[name])
+            if self.depths is not None and type(name) == str and name in self.depths:
+                return frame_getter(name, self.depths[name])
+            get = symb_table.get
+            return lambda: get(name)
+        elif issubclass(type(name), Value):
+            return lambda: name
+        elif type(name) == ClassFrame or type(name) == SpaceFrame:
+            s = str(name)
+            return lambda: s
+        else:
+            raise mex.Unimplemented(f"Getter for IR node type ({name})")
+
+    def setter(self, name):
+        """
+        Returns closure assigning value to name
+        """
+        if self.regs is not None and type(name) == str and name in self.regs:
+            return register_setter(self.regs[name])
+        if self.depths is not None and type(name) == str and name in self.depths:
+            return frame_setter(name, self.depths[name])
+        assign = symb_table.assign
+        return lambda v: assign(name, v)
+
+    def reads(self):
+        """
+        Variables read by this node, that can be resolved to a frame
+        """
+        return []
+
+    def writes(self):
+        """
+        Variables written by this node, None if it cannot be determined
+        """
+        return None
+
+    def lower(self, lw):
+        """
+        Appends flat version of this node into lowered code.
+        Instructions containing nested blocks override this
+        """
+        lw.emit(self)
+
     def output(self, indent=0):
         return (indent*IR.SPCS)+str(self)
 
@@ -40,7 +99,7 @@ def wrap(v):
     elif type(v) == float:
         return Float(v)
     elif type(v) == str:
-        return String(v, escape_chs=False)
+        return String(v)
     elif type(v) == bool:
         return Bool(v)
     elif type(v) == list:
@@ -50,6 +109,72 @@ def wrap(v):
     else:
         raise mex.Unimplemented(f"Wrapper for type '{type(v)}'")
 
+def frame_getter(name, offset):
+    """
+    Getter for variable resolved to frame offset from the top
+    """
+    st = symb_table
+    if offset == 0:
+        def get():
+            try:
+                return st.top_frame[name]
+            except KeyError:
+                return st.get(name)
+    else:
+        def get():
+            f = st.top_frame
+            for _ in range(offset):
+                f = f.parent
+            try:
+                return f[name]
+            except KeyError:
+                return st.get(name)
+    return get
+
+def frame_setter(name, offset):
+    """
+    Setter for variable resolved to frame offset from the top
+    """
+    st = symb_table
+    def set(v):
+        if type(v) == str:
+            v = share(st.get(v))
+        f = st.top_frame
+        for _ in range(offset):
+            f = f.parent
+        f[name] = v
+    return set
+
+def register_getter(slot):
+    """
+    Getter for temporary stored in a register of the running code
+    """
+    st = symb_table
+    def get():
+        return st.regs[slot]
+    return get
+
+def register_setter(slot):
+    """
+    Setter for temporary stored in a register of the running code
+    """
+    st = symb_table
+    def set(v):
+        if type(v) == str:
+            v = share(st.get(v))
+        st.regs[slot] = v
+    return set
+
+def register_count(code):
+    """
+    Amount of registers needed to run flat code
+    """
+    count = 0
+    for inst in code:
+        if inst.regs is not None and len(inst.regs) > 0:
+            count = max(count, max(inst.regs.values())+1)
+    return count
+
 def ir_str(value):
     if type(value) == list:
         return "".join(value)
@@ -58,6 +183,234 @@ def ir_str(value):
     else:
         return value.ir_str()
 
+class Loop:
+    """
+    Jumps of a loop waiting for their target during lowering
+    """
+    def __init__(self, depth):
+        self.depth = depth
+        self.breaks = []
+        self.continues = []
+
+    def set_continue(self, pos):
+        for j in self.continues:
+            j.target = pos
+
+class Lowering:
+    """
+    Lowering of nested ir into flat code with jumps
+    """
+    def __init__(self):
+        self.code = []
+        # Amount of frames pushed by the lowered code
+        self.depth = 0
+        # Amount of spaces and classes being defined
+        self.opaque = 0
+        self.loops = []
+        # Frame depth and opacity for each instruction in code
+        self.depths = []
+        self.opaques = []
+        # Types of names guaranteed when the code is entered
+        self.types = {}
+
+    def emit(self, inst):
+        self.code.append(inst)
+        self.depths.append(self.depth)
+        self.opaques.append(self.opaque > 0)
+        return inst
+
+    def pos(self):
+        return len(self.code)
+
+    def block(self, insts):
+        for i in insts:
+            i.lower(self)
+
+    def push_loop(self):
+        self.loops.append(Loop(self.depth))
+        return self.loops[-1]
+
+    def pop_loop(self, end):
+        for j in self.loops.pop().breaks:
+            j.target = end
+
+def successors(inst, pc):
+    if type(inst) == Jump:
+        return [inst.target]
+    elif type(inst) in {JumpIfNot, JumpIf, JumpIfFalsy, JumpShort, ForNext}:
+        return [pc+1, inst.target]
+    elif type(inst) in {Return, Break, Continue}:
+        return []
+    return [pc+1]
+
+def resolve(lw, args=None):
+    """
+    Resolves frames of variables accessed in lowered code.
+    For each variable depths of frames it must be and may be present in
+    are tracked. Access, which always hits the same frame, gets offset
+    of this frame from the top stored in instruction's depths.
+    Other accesses are left to be searched for at runtime.
+    @param lw Lowering with the code
+    @param args Names of function arguments or None for top level code
+    """
+    code = lw.code
+    if len(code) == 0:
+        return
+    empty = frozenset()
+    top = args is None
+    entry = {}
+    if not top:
+        for a in args:
+            entry[a] = (frozenset([0]), frozenset([0]))
+
+    def resolved(state, name):
+        must, may = state.get(name, (empty, empty))
+        if len(may) > 0 and max(may) in must:
+            return max(may)
+        return None
+
+    def transfer(pc, state, found):
+        inst = code[pc]
+        if lw.opaques[pc]:
+            return state
+        w = inst.writes()
+        if w is None:
+            return None
+        depth = lw.depths[pc]
+        for name in inst.reads():
+            if type(name) == str and name[0] != "$":
+                d = resolved(state, name)
+                if d is not None:
+                    found[name] = depth-d
+        state = dict(state)
+        cond = type(inst) in {SetIfNotSet, SetOrPrint, JumpShort}
+        for name in w:
+            if type(name) != str or name[0] == "$":
+                continue
+            must, may = state.get(name, (empty, empty))
+            d = resolved(state, name)
+            if d is not None:
+                if not cond:
+                    found[name] = depth-d
+            elif len(may) == 0 and (not top or depth == 0) and not cond:
+                found[name] = 0
+                state[name] = (must | {depth}, may | {depth})
+            else:
+                state[name] = (must, may | {depth})
+        return state
+
+    def join(a, b):
+        r = {}
+        for name in a.keys() | b.keys():
+            ma, ya = a.get(name, (empty, empty))
+            mb, yb = b.get(name, (empty, empty))
+            r[name] = (ma & mb, ya | yb)
+        return r
+
+    states = [None]*len(code)
+    states[0] = entry
+    work = [0]
+    while len(work) > 0:
+        pc = work.pop()
+        out = transfer(pc, states[pc], {})
+        if out is None:
+            return
+        for t in successors(code[pc], pc):
+            if t >= len(code):
+                continue
+            d = lw.depths[t]
+            out_t = {}
+            for name, (must, may) in out.items():
+                out_t[name] = (frozenset(x for x in must if x <= d), frozenset(x for x in may if x <= d))
+            new = out_t if states[t] is None else join(states[t], out_t)
+            if new != states[t]:
+                states[t] = new
+                work.append(t)
+
+    resolutions = {}
+    for pc, inst in enumerate(code):
+        if states[pc] is None:
+            continue
+        found = {}
+        transfer(pc, states[pc], found)
+        if id(inst) in resolutions:
+            # Instruction used on multiple places has to match on all of them
+            prev = resolutions[id(inst)][1]
+            found = {k: v for k, v in found.items() if prev.get(k) == v}
+        resolutions[id(inst)] = (inst, found)
+    for inst, found in resolutions.values():
+        inst.depths = found
+
+# Declared argument types the function bodies are specialized for
+NUMERIC_TYPES = {"Int": Int, "Float": Float}
+
+# Amount of calls after which function body is compiled into Python
+TIER_UP_CALLS = 100
+
+# Types of values, which can be folded and propagated
+CONST_TYPES = {Int, Float, Bool, Nil, String}
+
+def lower(insts, args=None, program=False, arg_types=None):
+    """
+    Lowers list of nested instructions into flat code and optimizes it
+    @param args Names of function arguments, None for top level code
+    @param program If insts are the whole program
+    @param arg_types Types of arguments checked before the code is run
+    @return Lowering holding the flat code
+    """
+    from passes import pass_manager
+    lw = Lowering()
+    if arg_types is not None:
+        lw.types = dict(arg_types)
+    lw.block(insts)
+    pass_manager.run(lw, program)
+    resolve(lw, args)
+    return lw
+
+def lower_block(insts, args=None, program=False, arg_types=None):
+    """
+    Lowers list of nested instructions into flat code
+    @param args Names of function arguments, None for top level code
+    @param program If insts are the whole program
+    @param arg_types Types of arguments checked before the code is run
+    """
+    return lower(insts, args, program, arg_types).code
+
+def lower_bodies(code):
+    """
+    Lowers bodies of functions defined in flat code before their first call,
+    so that they are cached together with the code
+    """
+    for i in code:
+        if issubclass(type(i), Fun) and type(i.body) == list and i.lowered is None:
+            try:
+                i.lower_body()
+            except mex.MashException:
+                # Errors found by lowering are reported on the call
+                continue
+            for lw in i.lowered:
+                if lw is not None:
+                    lower_bodies(lw.code)
+
+def compile_block(insts):
+    """
+    Compiles list of instructions into list of closures
+    """
+    return [i.compile() for i in insts]
+
+def exec_block(insts):
+    """
+    Lowers, compiles and runs list of instructions
+    @return Returned value and amount of frames to pop or None
+    """
+    from interpreter import run
+    code = lower_block(insts)
+    prev = symb_table.regs
+    symb_table.regs = [None]*register_count(code)
+    r = run(compile_block(code))
+    symb_table.regs = prev
+    return r
+
 class Instruction(IR):
     """
     Base class for all instructions
@@ -65,11 +418,22 @@ class Instruction(IR):
 
     def exec(self):
         """
-        Method to be overrriden by an instruction
+        Method to be overrriden by an instruction.
+        Returns None to continue with the next instruction, index of
+        instruction to jump to or returned value with amount of frames
+        to be popped by the caller
         """
         # TODO: Change to exception
         print("MISSING EXEC METHOD")
 
+    def compile(self):
+        """
+        Returns closure executing this instruction.
+        Instructions with hot paths override this to resolve
+        as much as possible before the execution
+        """
+        return self.exec
+
     def call(self):
         """
         Method to be overriden by instructions that are callable
@@ -84,6 +448,8 @@ class AssignVar(Instruction):
     """
     Variable declaration and definition
     """
+    OPERANDS = ("value",)
+
     def __init__(self, dst, value):
         self.dst = dst
         self.value = value
@@ -101,6 +467,31 @@ class AssignVar(Instruction):
         self.update(self.value)
         symb_table.assign(self.dst, self.value)
 
+    def compile(self):
+        if self.skip:
+            return lambda: None
+        value = self.value
+        set = self.setter(self.dst)
+        if not issubclass(type(value), Value):
+            get = self.getter(value)
+            return lambda: set(share(get()))
+        elif type(value).update is not Value.update:
+            def run():
+                value.update()
+                set(value)
+            return run
+        return lambda: set(value)
+
+    def reads(self):
+        if self.skip:
+            return []
+        return [self.value]
+
+    def writes(self):
+        if self.skip:
+            return []
+        return [self.dst]
+
     def __str__(self):
         if self.skip:
             return "NOP"
@@ -132,14 +523,73 @@ class AssignMultiple(Instruction):
             else:
                 symb_table.assign(d, v.get_value()[c])
 
+    def writes(self):
+        return self.dst
+
     def __str__(self):
         dst_str = ["".join(x) for x in self.dst]
         return f"MSET {ir_str(self.value)}, {dst_str}"
 
+class BuildList(Instruction):
+    """
+    List literal with variable elements, which creates
+    a new list from their current values
+    """
+    def __init__(self, dst, items):
+        self.dst = dst
+        self.items = items
+
+    def exec(self):
+        symb_table.assign(self.dst, List([share(self.get(x)) for x in self.items]))
+
+    def compile(self):
+        gets = [self.getter(x) for x in self.items]
+        set = self.setter(self.dst)
+        return lambda: set(List([share(get()) for get in gets]))
+
+    def reads(self):
+        return [x for x in self.items if type(x) == str]
+
+    def writes(self):
+        return [self.dst]
+
+    def __str__(self):
+        items = ", ".join(ir_str(x) for x in self.items)
+        return f"LIST [{items}], {ir_str(self.dst)}"
+
+class BuildDict(Instruction):
+    """
+    Dict literal with variable keys or values, which creates
+    a new dict from their current values
+    """
+    def __init__(self, dst, items):
+        self.dst = dst
+        self.items = items
+
+    def exec(self):
+        symb_table.assign(self.dst, Dict([(share(self.get(k)), share(self.get(v))) for k, v in self.items]))
+
+    def compile(self):
+        gets = [(self.getter(k), self.getter(v)) for k, v in self.items]
+        set = self.setter(self.dst)
+        return lambda: set(Dict([(share(k()), share(v())) for k, v in gets]))
+
+    def reads(self):
+        return [x for p in self.items for x in p if type(x) == str]
+
+    def writes(self):
+        return [self.dst]
+
+    def __str__(self):
+        items = ", ".join(f"{ir_str(k)}: {ir_str(v)}" for k, v in self.items)
+        return f"DICT {{{items}}}, {ir_str(self.dst)}"
+
 class Print(Instruction):
     """
     Variable declaration and definition
     """
+    OPERANDS = ("value",)
+
     def __init__(self, value, output_file=None, output_format=None):
         self.value = value
         self.output_file = output_file
@@ -161,6 +611,9 @@ class Print(Instruction):
         print(t, end="")
         output_print.append(t)
 
+    def writes(self):
+        return []
+
     def __str__(self):
         return f"PRINT {ir_str(self.value)}"
 
@@ -181,6 +634,9 @@ class Note(Instruction):
             with open(self.output_file, "a", encoding="utf-8") as outf:
                 outf.write(self.value.get_value())
 
+    def writes(self):
+        return []
+
     def __str__(self):
         #show = 15
         #if len(self.value.get_value()) > show:
@@ -202,6 +658,9 @@ class Doc(Instruction):
         if type(self.dst) in {Fun, SpaceFrame, ClassFrame}:
             self.dst.doc = self.value
 
+    def writes(self):
+        return []
+
     def __str__(self):
         #show = 15
         #if len(self.value.get_value()) > show:
@@ -227,6 +686,9 @@ class SetIfNotSet(Instruction):
         if not s:
             symb_table.assign(self.dst, self.value)
 
+    def writes(self):
+        return [self.dst]
+
     def __str__(self):
         return f"SETIFNOTSET {ir_str(self.value)}, {self.dst}"
 
@@ -262,6 +724,9 @@ class SetOrPrint(Instruction):
             print(t, end="")
             output_print.append(t)
 
+    def writes(self):
+        return [self.dst]
+
     def __str__(self):
         return f"SETORPRINT {ir_str(self.value)}, {self.dst}"
 
@@ -277,6 +742,9 @@ class ToString(Instruction):
         v = self.get(self.value)
         symb_table.assign(self.dst, String(str(v)))
 
+    def writes(self):
+        return [self.dst]
+
     def __str__(self):
         return f"TOSTR {ir_str(self.value)}, {self.dst}"
 
@@ -305,6 +773,9 @@ class Nop(Instruction):
     def exec(self):
         pass
 
+    def writes(self):
+        return []
+
     def __str__(self):
         return "NOP"
 
@@ -324,24 +795,19 @@ class If(Instruction):
             self.f = [self.f]
 
     def exec(self):
-        symb_table.push()
-        c = self.get(self.cnd)
-        if type(c) == types.Class:
-            raise mex.Unimplemented("Call to _to method")
-        elif type(c) != Bool and type(c) not in types.IMPLICIT_TO_BOOL:
-            raise mex.TypeError(f"Unexpected expression type '{c.type_name()}' in if statement condition")
-        else:
-            c = c.get_value()
-        try:
-            if c:
-                for i in self.t:
-                    i.exec()
-            else:
-                for i in self.f:
-                    i.exec()
-        except mex.FlowControlReturn as e:
-            raise mex.FlowControlReturn(e.value, e.frames+1)
-        symb_table.pop()
+        return exec_block([self])
+
+    def lower(self, lw):
+        lw.emit(PushFrame())
+        lw.depth += 1
+        jf = lw.emit(JumpIfNot(self.cnd, None, "if"))
+        lw.block(self.t)
+        jend = lw.emit(Jump())
+        jf.target = lw.pos()
+        lw.block(self.f)
+        jend.target = lw.pos()
+        lw.emit(PopFrame())
+        lw.depth -= 1
 
     def output(self, indent=0):
         t = self.t
@@ -374,29 +840,24 @@ class While(Instruction):
             self.t = [self.t]
 
     def exec(self):
-        symb_table.push()
-        c = self.get(self.cnd)
-        if type(c) == types.Class:
-            raise mex.Unimplemented("Call to _to method")
-        elif type(c) != Bool and type(c) not in types.IMPLICIT_TO_BOOL:
-            raise mex.TypeError(f"Unexpected expression type '{c.type_name()}' in while statement condition")
-        else:
-            c = c.get_value()
-        while c:
-            try:
-                for i in self.t:
-                    i.exec()
-            except mex.FlowControlBreak:
-                break
-            except mex.FlowControlContinue:
-                continue
-            except mex.FlowControlReturn as e:
-                raise mex.FlowControlReturn(e.value, e.frames+1)
-            # Run code for condition
-            for i in self.cnd_insts:
-                i.exec()
-            c = self.getV(self.cnd)
-        symb_table.pop()
+        return exec_block([self])
+
+    def lower(self, lw):
+        lw.emit(PushFrame())
+        lw.depth += 1
+        start = lw.pos()
+        jf = lw.emit(JumpIfNot(self.cnd, None, "while"))
+        loop = lw.push_loop()
+        lw.block(self.t)
+        loop.set_continue(lw.pos())
+        # Condition code is also run before the loop, so it is copied
+        # to be resolved separately
+        lw.block([copy(i) for i in self.cnd_insts])
+        lw.emit(Jump(start))
+        jf.target = lw.pos()
+        lw.pop_loop(lw.pos())
+        lw.emit(PopFrame())
+        lw.depth -= 1
 
     def output(self, indent=0):
         t = self.t
@@ -423,48 +884,21 @@ class DoWhile(Instruction):
             self.t = [self.t]
 
     def exec(self):
-        symb_table.push()
-        try:
-            for i in self.t:
-                i.exec()
-        except mex.FlowControlBreak:
-            symb_table.pop()
-            return
-        except mex.FlowControlContinue:
-            ...
-        except mex.FlowControlReturn as e:
-            raise mex.FlowControlReturn(e.value, e.frames+1)
+        return exec_block([self])
+
+    def lower(self, lw):
+        lw.emit(PushFrame())
+        lw.depth += 1
+        start = lw.pos()
+        loop = lw.push_loop()
+        lw.block(self.t)
+        loop.set_continue(lw.pos())
         # Run code for condition
-        for i in self.cnd_insts:
-            i.exec()
-        c = self.get(self.cnd)
-        if type(c) == types.Class:
-            raise mex.Unimplemented("Call to _to method")
-        elif type(c) != Bool and type(c) not in types.IMPLICIT_TO_BOOL:
-            raise mex.TypeError(f"Unexpected expression type '{c.type_name()}' in do while statement condition")
-        else:
-            c = c.get_value()
-        while c:
-            try:
-                for i in self.t:
-                    i.exec()
-            except mex.FlowControlBreak:
-                break
-            except mex.FlowControlContinue:
-                continue
-            except mex.FlowControlReturn as e:
-                raise mex.FlowControlReturn(e.value, e.frames+1)
-            # Run code for condition
-            for i in self.cnd_insts:
-                i.exec()
-            c = self.get(self.cnd)
-            if type(c) == types.Class:
-                raise mex.Unimplemented("Call to _to method")
-            elif type(c) != Bool and type(c) not in types.IMPLICIT_TO_BOOL:
-                raise mex.TypeError(f"Unexpected expression type '{c.type_name()}' in do while statement condition")
-            else:
-                c = c.get_value()
-        symb_table.pop()
+        lw.block(self.cnd_insts)
+        lw.emit(JumpIf(self.cnd, start, "do while"))
+        lw.pop_loop(lw.pos())
+        lw.emit(PopFrame())
+        lw.depth -= 1
 
     def output(self, indent=0):
         t = self.t
@@ -491,100 +925,22 @@ class For(Instruction):
             self.t = [self.t]
 
     def exec(self):
-        symb_table.push()
-        s = self.get(self.l)
-        if type(s) != List and type(s) != Dict and type(s) != types.Class:
-            raise mex.TypeError(f"Cannot iterate over {s.type_name()}")
-        v = s.get_value()
-        if type(s) == Dict:
-            v = s.items().get_value()
-        
-        if type(s) == types.Class:
-            if type(self.l) == list:
-                l += [".", "__next"]
-            else:
-                l = [self.l, ".", "__next"]
-            
-            next_call = FunCall(l, [])
-            next_call.exec()
-            a = symb_table.get(SymbTable.RETURN_NAME)
-            if not (type(a) == types.ClassFrame and a.name == "StopIteration"):
-                if len(self.i) > 1:
-                    if type(a) != List:
-                        raise mex.TypeError(f"Cannot unpack type {a.type_name()}")
-                    if len(self.i) > len(a.get_value()):
-                        raise mex.TypeError(f"Not enough values to unpack. Expected {len(self.i)}, but got {len(a.get_value())}")
-                    # Remove is unpacking of multiple to last one is allowed
-                    if len(self.i) < len(a.get_value()):
-                        raise mex.TypeError(f"Too many values to unpack. Expected {len(self.i)}, but got {len(a.get_value())}")
-                    for c, i_name in enumerate(self.i):
-                        if c == len(self.i)-1 and c < len(a.get_value())-1:
-                            symb_table.assign(i_name, List(a.get_value()[c:]))
-                        else:
-                            symb_table.assign(i_name, a.get_value()[c])
-                else:
-                    self.i = self.i[0]
-                    symb_table.assign(self.i, a)
-            while not (type(a) == types.ClassFrame and a.name == "StopIteration"):
-                try:
-                    for i in self.t:
-                        i.exec()
-                    next_call.exec()
-                    a = symb_table.get(SymbTable.RETURN_NAME)
-                    if not (type(a) == types.ClassFrame and a.name == "StopIteration"):
-                        if len(self.i) > 1:
-                            if type(a) != List:
-                                raise mex.TypeError(f"Cannot unpack type {a.type_name()}")
-                            if len(self.i) > len(a.get_value()):
-                                raise mex.TypeError(f"Not enough values to unpack. Expected {len(self.i)}, but got {len(a.get_value())}")
-                            # Remove is unpacking of multiple to last one is allowed
-                            if len(self.i) < len(a.get_value()):
-                                raise mex.TypeError(f"Too many values to unpack. Expected {len(self.i)}, but got {len(a.get_value())}")
-                            for c, i_name in enumerate(self.i):
-                                if c == len(self.i)-1 and c < len(a.get_value())-1:
-                                    symb_table.assign(i_name, List(a.get_value()[c:]))
-                                else:
-                                    symb_table.assign(i_name, a.get_value()[c])
-                        else:
-                            self.i = self.i[0]
-                            symb_table.assign(self.i, a)
-                    else:
-                        break
-                except mex.FlowControlBreak:
-                    break
-                except mex.FlowControlContinue:
-                    continue
-                except mex.FlowControlReturn as e:
-                    symb_table.pop()
-                    raise e
-        else:
-            for a in v:
-                if len(self.i) > 1:
-                    if type(a) != List:
-                        raise mex.TypeError(f"Cannot unpack type {a.type_name()}")
-                    if len(self.i) > len(a.get_value()):
-                        raise mex.TypeError(f"Not enough values to unpack. Expected {len(self.i)}, but got {len(a.get_value())}")
-                    # Remove is unpacking of multiple to last one is allowed
-                    if len(self.i) < len(a.get_value()):
-                        raise mex.TypeError(f"Too many values to unpack. Expected {len(self.i)}, but got {len(a.get_value())}")
-                    for c, i_name in enumerate(self.i):
-                        if c == len(self.i)-1 and c < len(a.get_value())-1:
-                            symb_table.assign(i_name, List(a.get_value()[c:]))
-                        else:
-                            symb_table.assign(i_name, a.get_value()[c])
-                else:
-                    symb_table.assign(self.i[0], a)
-                try:
-                    for i in self.t:
-                        i.exec()
-                except mex.FlowControlBreak:
-                    break
-                except mex.FlowControlContinue:
-                    continue
-                except mex.FlowControlReturn as e:
-                    symb_table.pop()
-                    raise e
-        symb_table.pop()
+        return exec_block([self])
+
+    def lower(self, lw):
+        lw.emit(PushFrame())
+        lw.depth += 1
+        lw.emit(ForInit(self.l))
+        start = lw.pos()
+        fnext = lw.emit(ForNext(self.i))
+        loop = lw.push_loop()
+        lw.block(self.t)
+        loop.set_continue(start)
+        lw.emit(Jump(start))
+        fnext.target = lw.pos()
+        lw.pop_loop(lw.pos())
+        lw.emit(PopFrame())
+        lw.depth -= 1
 
     def output(self, indent=0):
         t = self.t
@@ -599,6 +955,314 @@ class For(Instruction):
             t = "\n".join(str(i) for i in t)
         return f"FOR ({self.i} : {self.l}) {{\n{t}\n}}"
 
+class PushFrame(Instruction):
+    """
+    Pushes new frame for a block
+    """
+    def exec(self):
+        symb_table.push()
+
+    def compile(self):
+        return symb_table.push
+
+    def writes(self):
+        return []
+
+    def __str__(self):
+        return "PUSH"
+
+class PopFrame(Instruction):
+    """
+    Pops frame of a block
+    """
+    def exec(self):
+        symb_table.pop()
+
+    def compile(self):
+        return symb_table.pop
+
+    def writes(self):
+        return []
+
+    def __str__(self):
+        return "POP"
+
+class Jump(Instruction):
+    """
+    Unconditional jump, popping frames of blocks that are left
+    """
+    def __init__(self, target=None, pops=0):
+        self.target = target
+        self.pops = pops
+
+    def exec(self):
+        if self.pops > 0:
+            symb_table.pop(self.pops)
+        return self.target
+
+    def compile(self):
+        target = self.target
+        pops = self.pops
+        if pops == 0:
+            return lambda: target
+        pop = symb_table.pop
+        def run():
+            pop(pops)
+            return target
+        return run
+
+    def writes(self):
+        return []
+
+    def __str__(self):
+        if self.pops > 0:
+            return f"JMP {self.target}, POP {self.pops}"
+        return f"JMP {self.target}"
+
+class JumpIfNot(Instruction):
+    """
+    Jump taken when condition is false
+    """
+    OPERANDS = ("cnd",)
+    # Type of condition guaranteed by the code, set by type inference
+    known = None
+
+    def __init__(self, cnd, target, stmt):
+        self.cnd = cnd
+        self.target = target
+        self.stmt = stmt
+
+    def exec(self):
+        return self.compile()()
+
+    def check(self, c):
+        if type(c) == types.Class:
+            raise mex.Unimplemented("Call to _to method")
+        elif type(c) != Bool and type(c) not in types.IMPLICIT_TO_BOOL:
+            raise mex.TypeError(f"Unexpected expression type '{c.type_name()}' in {self.stmt} statement condition")
+        return c.get_value()
+
+    def compile(self):
+        cnd = self.getter(self.cnd)
+        check = self.check
+        target = self.target
+        if self.known is Bool:
+            def run():
+                if not cnd().value:
+                    return target
+            return run
+        def run():
+            if not check(cnd()):
+                return target
+        return run
+
+    def reads(self):
+        return [self.cnd]
+
+    def writes(self):
+        return []
+
+    def __str__(self):
+        return f"JMPF {ir_str(self.cnd)}, {self.target}"
+
+class JumpIf(JumpIfNot):
+    """
+    Jump taken when condition is true
+    """
+    def compile(self):
+        cnd = self.getter(self.cnd)
+        check = self.check
+        target = self.target
+        if self.known is Bool:
+            def run():
+                if cnd().value:
+                    return target
+            return run
+        def run():
+            if check(cnd()):
+                return target
+        return run
+
+    def __str__(self):
+        return f"JMPT {ir_str(self.cnd)}, {self.target}"
+
+class JumpIfFalsy(JumpIfNot):
+    """
+    Jump taken when value is falsy, any value is accepted
+    """
+    def check(self, c):
+        return c.get_value()
+
+    def __str__(self):
+        return f"JMPFALSY {ir_str(self.cnd)}, {self.target}"
+
+class JumpShort(Instruction):
+    """
+    Jump over right operand of logical operator when the left
+    one decides the result, which is then set
+    """
+    OPERANDS = ("src",)
+
+    def __init__(self, src, dst, result, target=None):
+        self.src = src
+        self.dst = dst
+        self.result = result
+        self.target = target
+
+    def exec(self):
+        return self.compile()()
+
+    def compile(self):
+        get = self.getter(self.src)
+        set = self.setter(self.dst)
+        result = self.result
+        target = self.target
+        def run():
+            s = get()
+            # Other types are left for the operator to handle or report
+            if type(s) == Bool or type(s) in types.IMPLICIT_TO_BOOL:
+                if bool(s.get_value()) == result:
+                    set(Bool(result))
+                    return target
+        return run
+
+    def reads(self):
+        return [self.src]
+
+    def writes(self):
+        return [self.dst]
+
+    def __str__(self):
+        return f"JMPSHORT {ir_str(self.src)}, {self.dst}, {self.result}, {self.target}"
+
+def iter_class(obj):
+    """
+    Iterates over object using its __next method
+    """
+    if type(obj) == list:
+        next_call = FunCall(obj+[".", "__next"], [])
+    else:
+        next_call = FunCall([obj, ".", "__next"], [])
+    while True:
+        next_call.exec()
+        a = symb_table.get(SymbTable.RETURN_NAME)
+        if type(a) == types.ClassFrame and a.name == "StopIteration":
+            return
+        yield a
+
+def is_range(obj):
+    """
+    Checks if object is a Range from libmash with unchanged __next method
+    """
+    return (obj.name == "Range" and obj.frame is symb_table.global_frame.get("Range")
+            and obj.attr.get("__next") is obj.frame.get("__next"))
+
+def iter_range(obj, r):
+    """
+    Iterates over Range object natively, its attribute i is kept updated
+    as if __next was called
+    """
+    a = r.attr
+    while True:
+        i = a.get("i")
+        end = a.get("end")
+        step = a.get("step")
+        if type(i) != Int or type(end) != Int or type(step) != Int:
+            # Attributes were changed, so the method has to be used
+            yield from iter_class(obj)
+            return
+        i = i.get_value()
+        end = end.get_value()
+        step = step.get_value()
+        if step >= 0 and i >= end:
+            return
+        if step < 0 and i <= end:
+            return
+        a["i"] = Int(i+step)
+        yield Int(i)
+
+class ForInit(Instruction):
+    """
+    Creates iterator for a for loop and stores it into loop's frame
+    """
+    def __init__(self, l):
+        self.l = l
+
+    def exec(self):
+        self.compile()()
+
+    def compile(self):
+        get = self.getter(self.l)
+        l = self.l
+        def run():
+            s = get()
+            if type(s) == List:
+                # The list cannot be changed in place while it is iterated
+                it = iter(share(s).get_value())
+            elif type(s) == Dict:
+                it = iter(s.items().get_value())
+            elif type(s) == types.Class:
+                if is_range(s):
+                    it = iter_range(l, s)
+                else:
+                    it = iter_class(l)
+            else:
+                raise mex.TypeError(f"Cannot iterate over {s.type_name()}")
+            symb_table.top()[SymbTable.ITER_NAME] = it
+        return run
+
+    def reads(self):
+        return [self.l]
+
+    def writes(self):
+        return []
+
+    def __str__(self):
+        return f"FORINIT {ir_str(self.l)}"
+
+class ForNext(Instruction):
+    """
+    Assigns next value of loop's iterator, jumps when there is none
+    """
+    def __init__(self, i, target=None):
+        self.i = i
+        self.target = target
+
+    def exec(self):
+        return self.compile()()
+
+    def compile(self):
+        names = self.i
+        target = self.target
+        set = self.setter(names[0])
+        def run():
+            try:
+                a = next(symb_table.top()[SymbTable.ITER_NAME])
+            except StopIteration:
+                return target
+            if len(names) > 1:
+                if type(a) != List:
+                    raise mex.TypeError(f"Cannot unpack type {a.type_name()}")
+                if len(names) > len(a.get_value()):
+                    raise mex.TypeError(f"Not enough values to unpack. Expected {len(names)}, but got {len(a.get_value())}")
+                # Remove is unpacking of multiple to last one is allowed
+                if len(names) < len(a.get_value()):
+                    raise mex.TypeError(f"Too many values to unpack. Expected {len(names)}, but got {len(a.get_value())}")
+                for c, i_name in enumerate(names):
+                    if c == len(names)-1 and c < len(a.get_value())-1:
+                        symb_table.assign(i_name, List(a.get_value()[c:]))
+                    else:
+                        symb_table.assign(i_name, a.get_value()[c])
+            else:
+                set(a)
+        return run
+
+    def writes(self):
+        return self.i
+
+    def __str__(self):
+        return f"FORNEXT {self.i}, {self.target}"
+
 class Internal(IR):
     """
     Internal implementation
@@ -606,10 +1270,37 @@ class Internal(IR):
     def __str__(self):
         return "internal"
 
+class BodyVersion:
+    """
+    Compiled version of function body, which is compiled
+    into Python function once it is called often enough
+    """
+    def __init__(self, fun, lw):
+        from interpreter import run
+        self.fun = fun
+        self.lw = lw
+        self.registers = register_count(lw.code)
+        self.compiled = compile_block(lw.code)
+        self.calls = 0
+        # Runs the body, partial adds no Python frame to each call
+        self.interpret = partial(run, self.compiled)
+
+    def tier_up(self):
+        from passes import pass_manager
+        import tier
+        if pass_manager.level == 0 or self.fun.method or self.fun.max_args == float("inf"):
+            return
+        f = tier.translate(self.lw, self.compiled, "".join(self.fun.name))
+        if f is not None:
+            self.interpret = f
+
 class Fun(Instruction):
     """
     Function
     """
+    # Dispatch table of the overload list the function was last put in
+    dispatch = None
+
     def __init__(self, name, args, body):
         self.name = name
         self.args = args
@@ -620,6 +1311,12 @@ class Fun(Instruction):
         if len(self.args) > 0 and type(self.args[-1][1]) == types.VarArgs:
             self.max_args = float("inf")
         self.body = body
+        # Lowered bodies, generic and specialized, kept with the cached code
+        self.lowered = None
+        # Body versions compiled on the first call
+        self.compiled = None
+        # Body version for arguments of declared types
+        self.specialized = None
         self.internal = False
         self.method = type(symb_table.top()) == ClassFrame
         if not self.method and self.name[0] == "(":
@@ -643,6 +1340,58 @@ class Fun(Instruction):
                     self.doc = i.value
         symb_table.define_fun(self.name, self.min_args, self.max_args, self)
 
+    def writes(self):
+        return [self.name]
+
+    def arg_names(self):
+        return [k[0] if type(k) == tuple else k for k, _ in self.args]
+
+    def typed_args(self):
+        """
+        @return Arguments declared with exactly one numeric type and their types
+        """
+        typed = {}
+        for k, v in self.args:
+            if type(k) == tuple and type(v) != VarArgs and len(k[1]) == 1:
+                if k[1][0] in NUMERIC_TYPES:
+                    typed[k[0]] = NUMERIC_TYPES[k[1][0]]
+        return typed
+
+    def lower_body(self):
+        """
+        Lowers body and its version for arguments of declared types
+        if it was not lowered yet
+        """
+        if self.lowered is None:
+            generic = lower(self.body, self.arg_names())
+            typed = self.typed_args()
+            spec = None
+            if len(typed) > 0:
+                spec = lower(self.body, self.arg_names(), arg_types=typed)
+            self.lowered = (generic, spec)
+
+    def body_version(self):
+        """
+        Compiles body on the first call and picks its version for the arguments
+        @return BodyVersion to be run
+        """
+        if self.compiled is None:
+            self.lower_body()
+            generic, spec = self.lowered
+            self.compiled = BodyVersion(self, generic)
+            if spec is not None:
+                self.specialized = (self.typed_args(), BodyVersion(self, spec))
+        if self.specialized is not None:
+            typed, version = self.specialized
+            # Named and default arguments are not checked by the call
+            top = symb_table.top()
+            for name, t in typed.items():
+                if type(top.get(name)) is not t:
+                    break
+            else:
+                return version
+        return self.compiled
+
     def wrap_internal(self, v):
         """
         Wraps value returned by internal function into IR value if not yet wrapped
@@ -674,11 +1423,17 @@ class Fun(Instruction):
                 raise mex.TypeError("Incorrect argument type in function call to '"+self.str_header()+"'")
             return rval, 1
         else:
-            for i in self.body:
-                try:
-                    i.exec()
-                except mex.FlowControlReturn as r:
-                    return r.value, r.frames
+            version = self.body_version()
+            # Each call has its own registers
+            prev = symb_table.regs
+            symb_table.regs = [None]*version.registers
+            version.calls += 1
+            if version.calls == TIER_UP_CALLS:
+                version.tier_up()
+            r = version.interpret()
+            symb_table.regs = prev
+            if r is not None:
+                return r
             return types.Nil(), 1
 
     def str_header(self):
@@ -790,13 +1545,19 @@ class Constructor(Fun):
                 raise mex.TypeError("Incorrect argument type in function call to '"+self.str_header()+"'")
             return rval, 1
         else:
-            for i in self.body:
-                try:
-                    i.exec()
-                except mex.FlowControlReturn as r:
-                    if type(r.value) != Nil:
-                        raise mex.TypeError("Constructor has to return nil")
-                    return r.value, r.frames
+            version = self.body_version()
+            # Each call has its own registers
+            prev = symb_table.regs
+            symb_table.regs = [None]*version.registers
+            version.calls += 1
+            if version.calls == TIER_UP_CALLS:
+                version.tier_up()
+            r = version.interpret()
+            symb_table.regs = prev
+            if r is not None:
+                if type(r[0]) != Nil:
+                    raise mex.TypeError("Constructor has to return nil")
+                return r
             if type(self.args[0][1]) == types.VarArgs:
                 return symb_table.get(self.args[0][0]).get_value()[0], 1
             return symb_table.get(self.args[0][0]), 1
@@ -882,6 +1643,8 @@ class FunCall(Instruction):
             self.name = name
             self.args = args
         self.dst = SymbTable.RETURN_NAME
+        # Resolved overload for the last seen function and argument types
+        self.cache = None
         self.pos_args = []
         self.named_args = []
         for i in self.args:
@@ -905,7 +1668,7 @@ class FunCall(Instruction):
                     frm = frame[i]
                     if not issubclass(type(frm), Frame):
                         continue
-                    if frm in symb_table.frames:
+                    if frm.live:
                         lframe = frm
                 if type(frame[-1]) == dict: # attr
                     method_call = False
@@ -943,108 +1706,50 @@ class FunCall(Instruction):
                 raise mex.TypeError("Type '"+types.type_name(fl)+"' is not callable")
             else:
                 raise mex.TypeError("'"+"".join(self.name)+"' is not callable")
-        f = []
-        new_obj = False
-        if type(fl) == ClassFrame:
-            new_obj = True
+        new_obj = type(fl) == ClassFrame
+        if new_obj:
             n = fl.name
             if n not in fl:
                 symb_table.assign(SymbTable.RETURN_NAME, fl.instance())
                 return
-            else:
-                for i in fl[n]:
-                    # Find matching function signature
-                    if i.max_args-1 >= len(self.args):
-                        f.append(i)
-                if len(f) == 0:
-                    raise mex.UndefinedReference(f"Arguments do not match any class '{self.name}' constructors")
+            overloads = fl[n]
         else:
-            for i in fl:
-                # Find closest matching function signature
-                if i.max_args >= len(self.args):
-                    f.append(i)
-            if len(f) == 0:
-                if self.name[0] == "'":
-                    raise mex.UndefinedReference(f"Arguments do not match any function's '{fl[0].name}' signatures")
-                else:
-                    raise mex.UndefinedReference(str(self))
-            else:
-                for fi in f:
-                    if type(fi) == Constructor:
-                        raise mex.TypeError("Constructor cannot be called as a function")
-        # Recheck if function was assigned to the object or if it is the class method
-        if not method_call and len(f) > 0:
-            method_call = f[0].method
+            overloads = fl
+        table = symb_table.dispatch_table(overloads)
+        key = (method_call, len(self.args))
+        if self.cache is None or self.cache[0] is not table or self.cache[1] != key:
+            # Candidates do not depend on types of the arguments
+            self.cache = (table, key, self.resolve(fl, table, new_obj, method_call))
+        candidates = self.cache[2]
+        values = self.arg_values()
+        arg_types = (candidates[2], len(self.args))+tuple(types.type_name(v) for v in values)
+        f_match = table.matches.get(arg_types)
+        if f_match is None:
+            f_match = self.match(candidates, values)
+            table.matches[arg_types] = f_match
+        self_arg, start_arg_i = candidates[1], candidates[2]
+
         assigned = []
-        start_arg_i = 0
-        if new_obj:
-            if len(f[0].args) == 0:
-                raise mex.TypeError("Class methods have to take the object as its first attribute")
-            if type(f[0].args[0][0]) == tuple:
-                raise mex.TypeError("Object argument (self) cannot be type constrained")
-            if type(f[0].args[0][1]) == types.VarArgs:
-                assigned = [(f[0].args[0][0], types.List([fl.instance()]+self.pos_args))]
+        if self_arg is not None:
+            if new_obj:
+                obj = fl.instance()
             else:
-                assigned = [(f[0].args[0][0], fl.instance())]
-            start_arg_i = 1
-        elif method_call:
-            if len(f[0].args) == 0:
-                raise mex.TypeError("Class methods have to take the object as its first attribute")
-            if type(f[0].args[0][0]) == tuple:
-                raise mex.TypeError("Object argument (self) cannot be type constrained")
-            if type(f[0].args[0][1]) == types.VarArgs:
-                assigned = [(f[0].args[0][0], types.List([self.name[-3]]+self.pos_args))]
+                obj = self.name[-3]
+            if self_arg[1]:
+                assigned = [(self_arg[0], types.List([obj]+values))]
             else:
-                assigned = [(f[0].args[0][0], self.name[-3])]
-            start_arg_i = 1
-
-        f_match = None
-        f_excp = None
-        assign_rest = []
-        f.sort(key=lambda x: sum([1 if type(a[0]) == tuple else 0 for a in x.args]), reverse=True)
-        for f_adept in f:
-            assign_rest = []
-            found = True
-            f_match = f_adept
-            for i, a in enumerate(f_adept.args[start_arg_i:]):
-                v = a[1]
-                a = a[0]
-                a_str = str(a) if type(a) != tuple else str(a[0])
-                if type(v) == types.VarArgs:
-                    value = types.List(self.pos_args[i:])
-                    # Update in case of variable names
-                    value.update()
-                else:
-                    if i >= len(self.pos_args):
-                        if v is None:
-                            f_excp = mex.TypeError(f"Function call to '{f_adept.str_header()}' is missing required positional argument '{a_str}'")
-                            found = False
-                            break
-                        else:
-                            break
-                    passed = self.pos_args[i]
-                    value = passed
-                    if type(passed) == str or type(passed) == list: 
-                        # Variable
-                        value = symb_table.get(passed)
-                    if type(a) == tuple:
-                        for t in a[1]:
-                            if t == value.type_name():
-                                break
-                        else:
-                            found = False
-                            supp_t = ", ".join(a[1])
-                            f_excp = mex.TypeError(f"Passed in value for argument {a_str} has unexpected type ({value.type_name()}). Value should be of following type: {supp_t}")
-                if type(a) == tuple:
-                    assign_rest.append((a[0], value))
-                else:
-                    assign_rest.append((a, value))
-            if found:
+                assigned = [(self_arg[0], obj)]
+        for i, a in enumerate(f_match.args[start_arg_i:]):
+            k, v = a
+            if type(k) == tuple:
+                k = k[0]
+            if type(v) == types.VarArgs:
+                value = types.List(values[i:])
+            elif i >= len(values):
                 break
-
-        if not found:
-            raise f_excp
-        assigned += assign_rest
+            else:
+                value = values[i]
+            assigned.append((k, value))
 
         for k, v in self.named_args:
             for a, b in f_match.args:
@@ -1058,14 +1763,14 @@ class FunCall(Instruction):
         prev_top = symb_table.top()
         if lframe is not None:
             symb_table.move_top(lframe)
-        elif frame in symb_table.frames:
+        elif issubclass(type(frame), Frame) and frame.live:
             symb_table.move_top(frame)
         else:
             lframe = symb_table.get_frame(self.name, flist=True)
             # There is a chance that the function is nested and then
             # we need to get the lowest level frame
             for frm in reversed(lframe):
-                if frm in symb_table.frames:
+                if issubclass(type(frm), Frame) and frm.live:
                     symb_table.move_top(frm)
         # Push new frame and arguments
         symb_table.push(True)
@@ -1075,9 +1780,27 @@ class FunCall(Instruction):
                 if type(k) == tuple:
                     k = k[0]
                 symb_table.assign(k, v)
+        top = symb_table.top_frame
         for k, v in assigned:
-            symb_table.assign(k, v)
-        ret_val, frames = f_match.call()
+            if issubclass(type(v), Value):
+                # New frame is shadowing, so values are always set in it
+                top[k] = v
+            else:
+                symb_table.assign(k, v)
+        if type(f_match) is Fun and not f_match.internal:
+            # Body is run from here, so that each Mash call nests only
+            # this frame and the dispatch loop like the tree walking did
+            version = f_match.body_version()
+            prev = symb_table.regs
+            symb_table.regs = [None]*version.registers
+            version.calls += 1
+            if version.calls == TIER_UP_CALLS:
+                version.tier_up()
+            r = version.interpret()
+            symb_table.regs = prev
+            ret_val, frames = (types.Nil(), 1) if r is None else r
+        else:
+            ret_val, frames = f_match.call()
         if type(ret_val) == str:
             ret_val = symb_table.get(ret_val)
         #print(symb_table, "\n---\n")
@@ -1085,6 +1808,90 @@ class FunCall(Instruction):
         symb_table.move_top(prev_top)
         symb_table.assign(SymbTable.RETURN_NAME, ret_val)
 
+    def arg_values(self):
+        values = []
+        for passed in self.pos_args:
+            if type(passed) == str or type(passed) == list:
+                # Variable, which is now also bound to the argument
+                values.append(share(symb_table.get(passed)))
+            else:
+                values.append(passed)
+        return values
+
+    def resolve(self, fl, table, new_obj, method_call):
+        """
+        Finds candidate functions for the call
+        @return Candidates sorted by amount of typed arguments,
+                name of object argument and if it is variadic or None
+                and index of the first argument to be passed
+        """
+        if new_obj:
+            # Find matching function signature
+            f = table.candidates(len(self.args)+1)
+            if len(f) == 0:
+                raise mex.UndefinedReference(f"Arguments do not match any class '{self.name}' constructors")
+        else:
+            # Find closest matching function signature
+            f = table.candidates(len(self.args))
+            if len(f) == 0:
+                if self.name[0] == "'":
+                    raise mex.UndefinedReference(f"Arguments do not match any function's '{fl[0].name}' signatures")
+                else:
+                    raise mex.UndefinedReference(str(self))
+            else:
+                for fi in f:
+                    if type(fi) == Constructor:
+                        raise mex.TypeError("Constructor cannot be called as a function")
+        # Recheck if function was assigned to the object or if it is the class method
+        if not method_call and len(f) > 0:
+            method_call = f[0].method
+        self_arg = None
+        start_arg_i = 0
+        if new_obj or method_call:
+            if len(f[0].args) == 0:
+                raise mex.TypeError("Class methods have to take the object as its first attribute")
+            if type(f[0].args[0][0]) == tuple:
+                raise mex.TypeError("Object argument (self) cannot be type constrained")
+            self_arg = (f[0].args[0][0], type(f[0].args[0][1]) == types.VarArgs)
+            start_arg_i = 1
+        return f, self_arg, start_arg_i
+
+    def match(self, candidates, values):
+        """
+        Picks the first candidate accepting passed in arguments
+        @return Matched function
+        """
+        f, self_arg, start_arg_i = candidates
+        f_excp = None
+        for f_adept in f:
+            found = True
+            for i, a in enumerate(f_adept.args[start_arg_i:]):
+                v = a[1]
+                a = a[0]
+                a_str = str(a) if type(a) != tuple else str(a[0])
+                if type(v) == types.VarArgs:
+                    continue
+                if i >= len(values):
+                    if v is None:
+                        f_excp = mex.TypeError(f"Function call to '{f_adept.str_header()}' is missing required positional argument '{a_str}'")
+                        found = False
+                    break
+                value = values[i]
+                if type(a) == tuple:
+                    for t in a[1]:
+                        if t == value.type_name():
+                            break
+                    else:
+                        found = False
+                        supp_t = ", ".join(a[1])
+                        f_excp = mex.TypeError(f"Passed in value for argument {a_str} has unexpected type ({value.type_name()}). Value should be of following type: {supp_t}")
+            if found:
+                return f_adept
+        raise f_excp
+
+    def writes(self):
+        return []
+
     def __str__(self):
         args = []
         for k in self.args:
@@ -1116,6 +1923,9 @@ class Member(Instruction):
         else:
             symb_table.assign(self.dst, v)
 
+    def writes(self):
+        return [self.dst]
+
     def __str__(self):
         return f"AT {ir_str(self.src)}, {ir_str(self.index)}, {self.dst}"
 
@@ -1144,6 +1954,9 @@ class Slice(Instruction):
         else:
             symb_table.assign(self.dst, v)
 
+    def writes(self):
+        return [self.dst]
+
     def __str__(self):
         end_str = types.Nil() if self.i2 is None else ir_str(self.i2)
         start_str = types.Nil() if self.i1 is None else ir_str(self.i1)
@@ -1161,6 +1974,13 @@ class SpacePush(Instruction):
     def exec(self):
         symb_table.push_space(self.name)
 
+    def lower(self, lw):
+        lw.emit(self)
+        lw.opaque += 1
+
+    def writes(self):
+        return [self.name]
+
     def __str__(self):
         return f"SPCPUSH {self.name}"
 
@@ -1174,6 +1994,13 @@ class SpacePop(Instruction):
     def exec(self):
         symb_table.pop_space()
 
+    def lower(self, lw):
+        lw.emit(self)
+        lw.opaque -= 1
+
+    def writes(self):
+        return []
+
     def __str__(self):
         return "SPCPOP"
 
@@ -1189,6 +2016,13 @@ class ClassPush(Instruction):
     def exec(self):
         symb_table.push_class(self.name, self.extends)
 
+    def lower(self, lw):
+        lw.emit(self)
+        lw.opaque += 1
+
+    def writes(self):
+        return [self.name]
+
     def __str__(self):
         return f"CLSPUSH {self.name}"
 
@@ -1202,6 +2036,13 @@ class ClassPop(Instruction):
     def exec(self):
         symb_table.pop_class()
 
+    def lower(self, lw):
+        lw.emit(self)
+        lw.opaque -= 1
+
+    def writes(self):
+        return []
+
     def __str__(self):
         return "CLSPOP"
 
@@ -1209,6 +2050,8 @@ class Keyword(Instruction):
     """
     Keyword instruction
     """
+    def writes(self):
+        return []
 
 class Break(Keyword):
     """
@@ -1217,6 +2060,12 @@ class Break(Keyword):
     def exec(self):
         raise mex.FlowControlBreak()
 
+    def lower(self, lw):
+        if len(lw.loops) == 0:
+            lw.emit(self)
+        else:
+            lw.loops[-1].breaks.append(lw.emit(Jump(None, lw.depth-lw.loops[-1].depth)))
+
     def __str__(self):
         return "break"
 
@@ -1227,6 +2076,12 @@ class Continue(Keyword):
     def exec(self):
         raise mex.FlowControlContinue()
 
+    def lower(self, lw):
+        if len(lw.loops) == 0:
+            lw.emit(self)
+        else:
+            lw.loops[-1].continues.append(lw.emit(Jump(None, lw.depth-lw.loops[-1].depth)))
+
     def __str__(self):
         return "continue"
 
@@ -1234,13 +2089,33 @@ class Return(Keyword):
     """
     Return
     """
+    OPERANDS = ("value",)
+
     def __init__(self, value):
         self.value = value
+        self.frames = 1
 
     def exec(self):
         v = self.get(self.value)
         v.update()
-        raise mex.FlowControlReturn(v)
+        return v, self.frames
+
+    def lower(self, lw):
+        # Frames pushed inside of the function are popped by the caller
+        self.frames = lw.depth+1
+        lw.emit(self)
+
+    def compile(self):
+        get = self.getter(self.value)
+        frames = self.frames
+        def run():
+            v = get()
+            v.update()
+            return v, frames
+        return run
+
+    def reads(self):
+        return [self.value]
 
     def __str__(self):
         return "return "+str(self.value)
@@ -1249,19 +2124,25 @@ class Expr(IR):
     """
     Expression
     """
+    OPERANDS = ("src1", "src2")
+    # Operation on numeric values used once operand types are known
+    FAST = None
+    # Operand types and result type guaranteed by the code, set by specialization
+    known = None
+
     def check_types(self, op, s1, s2, allowed):
         if type(s1) == list:
             s1 = s1[0]
         if type(s2) == list:
             s2 = s2[0]
         if (type(s1) == str or type(s2) == str) or not ((type(s1) in allowed) and (type(s2) in allowed)):
-            raise mex.TypeError(f"Unsupported types for '{op}'. Given values are '{s1}' and '{s2}'")
+            raise mex.TypeError(f"Unsupported types for '{op}'", given=f"Given values are '{s1}' and '{s2}'")
 
     def check_type(self, op, s, allowed):
         if type(s) == list:
             s = s[0]
         if type(s) == str or (type(s) not in allowed):
-            raise mex.TypeError(f"Unsupported type for '{op}'. Given value is '{s}'")
+            raise mex.TypeError(f"Unsupported type for '{op}'", given=f"Given value is '{s}'")
 
     def class_call(self, fname, s1, s2):
         if type(s1) == types.Class:
@@ -1269,10 +2150,104 @@ class Expr(IR):
             return types.Var(SymbTable.RETURN_NAME)
         return None
 
+    def exec(self):
+        symb_table.assign(self.dst, self.eval(self.get(self.src1), self.get(self.src2)))
+
+    def compile(self):
+        get1 = self.getter(self.src1)
+        get2 = self.getter(self.src2)
+        evaluate = self.eval
+        set = self.setter(self.dst)
+        fast = type(self).FAST
+        if fast is None:
+            def run():
+                set(evaluate(get1(), get2()))
+            return run
+        if self.known is not None:
+            make = self.known[-1] or wrap
+            def run():
+                s1 = get1()
+                s2 = get2()
+                try:
+                    set(make(fast(s1.value, s2.value)))
+                except Exception:
+                    # Error is raised by the general evaluation
+                    set(evaluate(s1, s2))
+            return run
+        # Types of operands the fast path is specialized for
+        guard = None
+        def run():
+            nonlocal guard
+            s1 = get1()
+            s2 = get2()
+            if guard is not None:
+                if type(s1) is guard[0] and type(s2) is guard[1]:
+                    try:
+                        set(wrap(fast(s1.value, s2.value)))
+                        return
+                    except Exception:
+                        # Error is raised by the general evaluation
+                        pass
+                guard = None
+            set(evaluate(s1, s2))
+            t1 = type(s1)
+            t2 = type(s2)
+            if (t1 is Int or t1 is Float) and (t2 is Int or t2 is Float):
+                guard = (t1, t2)
+        return run
+
+    def reads(self):
+        return [self.src1, self.src2]
+
+    def writes(self):
+        return [self.dst]
+
+class UnExpr(Expr):
+    """
+    Unary expression
+    """
+    OPERANDS = ("src1",)
+
+    def exec(self):
+        symb_table.assign(self.dst, self.eval(self.get(self.src1)))
+
+    def compile(self):
+        get1 = self.getter(self.src1)
+        evaluate = self.eval
+        set = self.setter(self.dst)
+        fast = type(self).FAST
+        if fast is None:
+            def run():
+                set(evaluate(get1()))
+            return run
+        if self.known is not None:
+            make = self.known[-1] or wrap
+            def run():
+                set(make(fast(get1().value)))
+            return run
+        guard = None
+        def run():
+            nonlocal guard
+            s1 = get1()
+            if guard is not None:
+                if type(s1) is guard:
+                    set(wrap(fast(s1.value)))
+                    return
+                guard = None
+            set(evaluate(s1))
+            if type(s1) is Int or type(s1) is Float:
+                guard = type(s1)
+        return run
+
+    def reads(self):
+        return [self.src1]
+
 class TernaryIf(Expr):
     """
     Ternary If
     """
+    OPERANDS = ("cnd", "t", "f")
+
     def __init__(self, cnd, t, f, dst):
         self.cnd = cnd
         self.t = t
@@ -1286,30 +2261,101 @@ class TernaryIf(Expr):
         else:
             symb_table.assign(self.dst, self.f)
 
+    def compile(self):
+        return self.exec
+
+    def reads(self):
+        return []
+
     def __str__(self):
         return f"TIF {self.cnd}, {self.t}, {self.f}, {self.dst}"
 
+class LazyTernaryIf(Instruction):
+    """
+    Ternary If evaluating only the taken branch
+    """
+    def __init__(self, cnd, t_insts, t, f_insts, f, dst):
+        self.cnd = cnd
+        self.t_insts = t_insts
+        self.t = t
+        self.f_insts = f_insts
+        self.f = f
+        self.dst = dst
+
+    def exec(self):
+        return exec_block([self])
+
+    def lower(self, lw):
+        jf = lw.emit(JumpIfFalsy(self.cnd, None, "ternary if"))
+        lw.block(self.t_insts)
+        lw.emit(AssignVar(self.dst, self.t))
+        jend = lw.emit(Jump())
+        jf.target = lw.pos()
+        lw.block(self.f_insts)
+        lw.emit(AssignVar(self.dst, self.f))
+        jend.target = lw.pos()
+
+    def output(self, indent=0):
+        spc = (indent*IR.SPCS)
+        t = "\n".join(i.output(indent+1) for i in self.t_insts)
+        f = "\n".join(i.output(indent+1) for i in self.f_insts)
+        return spc+f"TIF ({ir_str(self.cnd)}) {{\n{t}\n{spc}}} {{\n{f}\n{spc}}} {ir_str(self.t)}, {ir_str(self.f)}, {self.dst}"
+
+    def __str__(self):
+        t = "\n".join(str(i) for i in self.t_insts)
+        f = "\n".join(str(i) for i in self.f_insts)
+        return f"TIF ({ir_str(self.cnd)}) {{\n{t}\n}} {{\n{f}\n}} {ir_str(self.t)}, {ir_str(self.f)}, {self.dst}"
+
+class ShortCircuit(Instruction):
+    """
+    Logical operator evaluating its right operand only when needed
+    """
+    def __init__(self, op, right, result):
+        self.op = op
+        self.right = right
+        # Value of the left operand that decides the result
+        self.result = result
+        self.dst = op.dst
+
+    def exec(self):
+        return exec_block([self])
+
+    def lower(self, lw):
+        jshort = lw.emit(JumpShort(self.op.src1, self.dst, self.result))
+        lw.block(self.right)
+        lw.emit(self.op)
+        jshort.target = lw.pos()
+
+    def output(self, indent=0):
+        spc = (indent*IR.SPCS)
+        right = "\n".join(i.output(indent+1) for i in self.right)
+        return spc+f"SHORT ({ir_str(self.op.src1)}, {self.result}) {{\n{right}\n{spc}}} {self.op}"
+
+    def __str__(self):
+        right = "\n".join(str(i) for i in self.right)
+        return f"SHORT ({ir_str(self.op.src1)}, {self.result}) {{\n{right}\n}} {self.op}"
+
 class Mul(Expr):
     """
     Multiplication
     """
+    FAST = operator.mul
+
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(*)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("*", s1, s2, {Int, Float})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1*v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"MUL {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1318,17 +2364,17 @@ class Add(Expr):
     """
     Addition
     """
+    FAST = operator.add
+
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(+)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             try:
                 self.check_types("+", s1, s2, {Int, Float})
@@ -1342,7 +2388,35 @@ class Add(Expr):
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1+v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
+
+    def compile(self):
+        run = super().compile()
+        if self.known is not None or type(self.dst) != str or self.src1 != self.dst:
+            return run
+        # Accumulation into a variable (+=), which changes the value in place
+        # when the value was created by this accumulation and not shared since
+        get1 = self.getter(self.src1)
+        get2 = self.getter(self.src2)
+        evaluate = self.eval
+        set = self.setter(self.dst)
+        def accumulate():
+            s1 = get1()
+            t = type(s1)
+            if t is List or t is String:
+                s2 = get2()
+                if type(s2) is t:
+                    if not s1.owned:
+                        r = evaluate(s1, s2)
+                        r.owned = True
+                        set(r)
+                    elif t is String:
+                        s1.append(s2.value)
+                    else:
+                        s1.extend(s2.value)
+                    return
+            run()
+        return accumulate
 
     def __str__(self):
         return f"ADD {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1351,23 +2425,23 @@ class Sub(Expr):
     """
     Subtraction
     """
+    FAST = operator.sub
+
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(-)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("-", s1, s2, {Int, Float})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1-v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"SUB {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1376,23 +2450,23 @@ class FDiv(Expr):
     """
     Float division
     """
+    FAST = operator.truediv
+
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(/)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("/", s1, s2, {Int, Float})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1/v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"FDIV {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1401,23 +2475,23 @@ class IDiv(Expr):
     """
     Int division
     """
+    FAST = operator.floordiv
+
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(//)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("//", s1, s2, {Int, Float})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1//v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"IDIV {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1426,23 +2500,23 @@ class Mod(Expr):
     """
     Int division
     """
+    FAST = operator.mod
+
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(%)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("%", s1, s2, {Int, Float})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1 % v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"MOD {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1451,23 +2525,23 @@ class Exp(Expr):
     """
     Exponentiation
     """
+    FAST = operator.pow
+
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(^)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("^", s1, s2, {Int, Float})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1 ** v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"EXP {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1481,9 +2555,10 @@ class Cat(Expr):
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
+        if type(s1) is String and type(s2) is String:
+            # Values of Strings need no conversion
+            return s1.concat(s2)
         if type(s1) == list:
             v1 = s1[0].fstr()
         else:
@@ -1503,7 +2578,7 @@ class Cat(Expr):
                 raise mex.TypeError(f"Attribute of ++ has incorrect type. String is expected, but got {v2.type_name()}")
         
         r = v1+v2
-        symb_table.assign(self.dst, wrap(r))
+        return wrap(r)
 
     def __str__(self):
         return f"CAT {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1517,14 +2592,12 @@ class In(Expr):
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = s2._in(s1)
         if type(r) == types.Var:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"IN {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1538,26 +2611,23 @@ class LOr(Expr):
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(or)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
+            # Types are checked before the conversion to report the given ones
+            self.check_types("or", s1, s2, {Bool} | types.IMPLICIT_TO_BOOL)
             if type(s1) in types.IMPLICIT_TO_BOOL:
-                v1 = bool(v1.get_value())
-                s1 = types.Bool(v1)
+                v1 = bool(s1.get_value())
             else:
                 v1 = s1.get_value()
             if type(s2) in types.IMPLICIT_TO_BOOL:
-                v2 = bool(v2.get_value())
-                s2 = types.Bool(v2)
+                v2 = bool(s2.get_value())
             else:
                 v2 = s2.get_value()
-            self.check_types("or", s1, s2, {Bool})
             r = v1 or v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"LOR {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1571,26 +2641,23 @@ class LAnd(Expr):
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(and)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
+            # Types are checked before the conversion to report the given ones
+            self.check_types("and", s1, s2, {Bool} | types.IMPLICIT_TO_BOOL)
             if type(s1) in types.IMPLICIT_TO_BOOL:
-                v1 = bool(v1.get_value())
-                s1 = types.Bool(v1)
+                v1 = bool(s1.get_value())
             else:
                 v1 = s1.get_value()
             if type(s2) in types.IMPLICIT_TO_BOOL:
-                v2 = bool(v2.get_value())
-                s2 = types.Bool(v2)
+                v2 = bool(s2.get_value())
             else:
                 v2 = s2.get_value()
-            self.check_types("and", s1, s2, {Bool})
             r = v1 and v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"LAND {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1604,25 +2671,22 @@ class Or(Expr):
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(||)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
+            self.check_type("short-circuit or", s1, {Bool} | types.IMPLICIT_TO_BOOL)
             if type(s1) in types.IMPLICIT_TO_BOOL:
-                v1 = bool(v1.get_value())
-                s1 = types.Bool(v1)
+                v1 = bool(s1.get_value())
             else:
                 v1 = s1.get_value()
-            self.check_type("short-circuit or", s1, {Bool})
 
             if v1:
-                symb_table.assign(self.dst, wrap(v1))
+                return wrap(v1)
             else:
                 v2 = s2.get_value()
-                symb_table.assign(self.dst, wrap(v2))
+                return wrap(v2)
 
     def __str__(self):
         return f"OR {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
@@ -1636,40 +2700,36 @@ class And(Expr):
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(&&)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
+            self.check_type("short-circuit and", s1, {Bool} | types.IMPLICIT_TO_BOOL)
             if type(s1) in types.IMPLICIT_TO_BOOL:
-                v1 = bool(v1.get_value())
-                s1 = types.Bool(v1)
+                v1 = bool(s1.get_value())
             else:
                 v1 = s1.get_value()
-            self.check_type("short-circuit and", s1, {Bool})
 
             if not v1:
-                symb_table.assign(self.dst, wrap(v1))
+                return wrap(v1)
             else:
                 v2 = s2.get_value()
-                symb_table.assign(self.dst, wrap(v2))
+                return wrap(v2)
 
     def __str__(self):
         return f"AND {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
 
-class LNot(Expr):
+class LNot(UnExpr):
     
     def __init__(self, src1, dst):
         self.dst = dst
         self.src1 = src1
 
-    def exec(self):
-        s1 = self.get(self.src1)
+    def eval(self, s1):
         if type(s1) == types.Class:
             s1.call_method("(!)", [])
-            symb_table.assign(self.dst, SymbTable.RETURN_NAME)
+            return SymbTable.RETURN_NAME
         else:
             if type(s1) in types.IMPLICIT_TO_BOOL:
                 v1 = bool(s1.get_value())
@@ -1678,116 +2738,111 @@ class LNot(Expr):
                 v1 = s1.get_value()
             self.check_type("not", s1, {Bool})
             r = not v1
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"NOT {ir_str(self.src1)}, {self.dst}"
 
 class Lte(Expr):
+    FAST = operator.le
     
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(<=)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("<=", s1, s2, {Int, Float, String, Bool})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1 <= v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"LTE {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
 
 class Gte(Expr):
+    FAST = operator.ge
     
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(>=)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types(">=", s1, s2, {Int, Float, String, Bool})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1 >= v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"GTE {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
 
 class Gt(Expr):
+    FAST = operator.gt
     
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(>)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types(">", s1, s2, {Int, Float, String, Bool})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1 > v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"GT {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
 
 class Lt(Expr):
+    FAST = operator.lt
     
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(<)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("<", s1, s2, {Int, Float, String, Bool})
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1 < v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"LT {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
 
 class Eq(Expr):
+    FAST = operator.eq
     
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(==)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("==", s1, s2, {Int, Float, String, Bool, List, Dict, Nil, types.Class, SpaceFrame, ClassFrame, types.Enum, types.EnumValue})
             s1.update()
@@ -1795,24 +2850,23 @@ class Eq(Expr):
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1 == v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"EQ {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
 
 class Neq(Expr):
+    FAST = operator.ne
     
     def __init__(self, src1, src2, dst):
         self.dst = dst
         self.src1 = src1
         self.src2 = src2
 
-    def exec(self):
-        s1 = self.get(self.src1)
-        s2 = self.get(self.src2)
+    def eval(self, s1, s2):
         r = self.class_call("(!=)", s1, s2)
         if r is not None:
-            symb_table.assign(self.dst, r.name)
+            return r.name
         else:
             self.check_types("!=", s1, s2, {Int, Float, String, Bool, List, Dict, Nil, types.Class, SpaceFrame, ClassFrame})
             s1.update()
@@ -1820,23 +2874,23 @@ class Neq(Expr):
             v1 = s1.get_value()
             v2 = s2.get_value()
             r = v1 != v2
-            symb_table.assign(self.dst, wrap(r))
+            return wrap(r)
 
     def __str__(self):
         return f"NEQ {ir_str(self.src1)}, {ir_str(self.src2)}, {self.dst}"
 
-class Neg(Expr):
+class Neg(UnExpr):
+    FAST = operator.neg
     
     def __init__(self, src1, dst):
         self.dst = dst
         self.src1 = src1
 
-    def exec(self):
-        s1 = self.get(self.src1)
+    def eval(self, s1):
         self.check_type("-", s1, {Int, Float})
         v1 = s1.get_value()
         r = -v1
-        symb_table.assign(self.dst, wrap(r))
+        return wrap(r)
 
     def __str__(self):
         return f"NEG {ir_str(self.src1)}, {self.dst}"
@@ -112,7 +112,7 @@ def File_readlines_1(self):
     lines = f.readlines()
     r = []
     for f in lines:
-        r.append(types.String(f, False))
+        r.append(types.String(f))
     return types.List(r)
 
 def get_args_0():
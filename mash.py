@@ -77,9 +77,12 @@ class Initializer():
         i = 0
         while i < len(args):
             a = args[i]
-            if a in {"-l", "--lib-path", "-o"}:
+            if a in {"-l", "--lib-path", "-o", "-O"}:
                 i+=2
-            elif a in {"--version", "-v", "-s", "--parse-only", "--no-libmash", "--print-notes", "-p"}:
+            elif a in {"--version", "-v", "-s", "--parse-only", "--no-libmash", "--no-cache", "--print-notes", "-p"}:
+                i+=1
+            elif a.startswith("-O"):
+                # Level given with the option, argparse checks its value
                 i+=1
             elif a == "-e":
                 return i+2
@@ -104,13 +107,17 @@ class Initializer():
         argparser.add_argument('-v', dest='verbose', default=False, action='store_true',
                                 help='Verbose output for debugging.')
         argparser.add_argument('-s', dest='code_only', default=False, action='store_true',
-                                help='Parse and output generated code.')
+                                help='Parse and output generated code and code after each optimization pass.')
+        argparser.add_argument('-O', dest='opt_level', default=1, type=int, choices=[0, 1, 2],
+                                help='Optimization level, 0 runs the code as it was generated (default is 1).')
         #argparser.add_argument('mash_file', default=None, nargs='?',
         #                        help='File with Mash code.')
         argparser.add_argument('--parse-only', action='store_true', dest='parse_only',
                                 help='Runs only the parser.')
         argparser.add_argument('--no-libmash', action='store_true', default=False, dest='no_libmash',
                                 help='Does not include libmash.')
+        argparser.add_argument('--no-cache', action='store_true', default=False, dest='no_cache',
+                                help='Parses and generates all code again instead of using the code cached on disk.')
         argparser.add_argument('-l', '--lib-path', action='append', help='Path to folders to search for imports', 
                                 required=False, default=None, dest='lib_path', nargs=1)
         argparser.add_argument('-o', dest='output', default=None,
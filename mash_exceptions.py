@@ -21,7 +21,15 @@ class TypeError(MashException):
     """
     Type or value error
     """
-    def __init__(self, msg, *args: object):
+    def __init__(self, msg, *args: object, given=None):
+        """
+        @param given Description of the values the error was raised for,
+                     msg is kept without it so that it can be reused for other values
+        """
+        self.msg = msg
+        self.given = given
+        if given is not None:
+            msg = msg+". "+given
         super().__init__("Type error: "+msg, *args)
 
 class KeyError(MashException):
@@ -87,6 +95,13 @@ class ImportError(MashException):
     def __init__(self, msg, *args: object):
         super().__init__("Import error: "+msg, *args)
 
+class RecursionError(MashException):
+    """
+    Too deeply nested function calls
+    """
+    def __init__(self, msg, *args: object):
+        super().__init__("Recursion error: "+msg, *args)
+
 class FlowControl(MashException):
     """
     Exceptions for controlling flow
@@ -1,5 +1,4 @@
 import mash_exceptions as mex
-from copy import deepcopy
 
 def type_name(o):
     try:
@@ -40,6 +39,9 @@ class Value():
             return False
         return self.get_value() == other.get_value()
 
+    def __hash__(self):
+        return hash(self.get_value())
+
     def ir_str(self):
         return f"{self.type_name()}({self.fstr()})"
 
@@ -77,9 +79,9 @@ class Class(Value):
             for k, v in c.items():
                 if type(v) == list and type(v[0]) == Constructor:
                     continue
-                self.attr[k] = v
+                self.attr[k] = share(v)
         for k, v in self.frame.items():
-            self.attr[k] = v
+            self.attr[k] = share(v)
         self.ret = Var(SymbTable.RETURN_NAME)
 
     def call_method(self, fname, args):
@@ -180,6 +182,9 @@ class EnumValue(Value):
     def __eq__(self, other):
         return id(self) == id(other)
 
+    def __hash__(self):
+        return id(self)
+
     def type_name(self):
         return self.enum_name
 
@@ -191,24 +196,78 @@ class EnumValue(Value):
 
 from symbol_table import ClassFrame, SpaceFrame, symb_table
 
+# Length from which concatenated strings are kept in pieces
+ROPE_LENGTH = 256
+
 class String(Value):
     """
     String
     """
-    def __init__(self, value, escape_chs=True):
-        self.original = value
-        self.value = self.escape(value) if escape_chs else value
-
-    def escape(self, value):
-        return value.replace("\\n", "\n"
-            ).replace("\\t", "\t"
-            ).replace("\\", "\\"
-            ).replace("\\\"", "\""
-            ).replace("\\a", "\a"
-            ).replace("\\b", "\b"
-            ).replace("\\f", "\f"
-            ).replace("\\r", "\r"
-            ).replace("\\v", "\v")
+    # Set for values bound only to the variable, which created them by +=
+    owned = False
+
+    def __init__(self, value, original=None):
+        """
+        @param value Text with escape sequences already decoded
+        @param original Text of the literal, if it differs from the value
+        """
+        self.original = original
+        self.value = value
+
+    def __getattr__(self, name):
+        # Value is removed while the string consists of pieces
+        parts = self.__dict__.get("parts")
+        if name != "value" or parts is None:
+            raise AttributeError(name)
+        self.value = String.join(parts)
+        del self.parts
+        return self.value
+
+    @staticmethod
+    def join(parts):
+        """
+        Joins pieces of a string, which are Python strings or
+        other Strings, whose pieces may not be joined yet
+        """
+        out = []
+        pending = [iter(parts)]
+        while len(pending) > 0:
+            for p in pending[-1]:
+                if type(p) == str:
+                    out.append(p)
+                elif "parts" in p.__dict__:
+                    # Nested pieces are joined without joining the String
+                    pending.append(iter(p.parts))
+                    break
+                else:
+                    out.append(p.value)
+            else:
+                pending.pop()
+        return "".join(out)
+
+    def append(self, s):
+        """
+        Appends string in place, the value is joined once it is read
+        Only owned values can be changed
+        """
+        if "parts" not in self.__dict__:
+            self.parts = [self.value]
+            del self.value
+            self.original = None
+        self.parts.append(s)
+
+    def concat(self, other):
+        """
+        @return New String with other appended, long strings are joined
+                once the value is read, so repeated concatenation is linear
+        """
+        if "parts" not in self.__dict__ and len(self.value) < ROPE_LENGTH:
+            return String(self.value+other.value)
+        r = String("")
+        r.parts = [share(self), share(other)]
+        del r.value
+        r.original = None
+        return r
 
     def __str__(self):
         return self.value
@@ -238,7 +297,12 @@ class String(Value):
             return False
         return self.value == other.value
 
+    def __hash__(self):
+        return hash(self.value)
+
     def fstr(self):
+        if self.original is None:
+            return "\""+self.value+"\""
         return "\""+self.original+"\""
 
 class FString(String):
@@ -247,7 +311,7 @@ class FString(String):
     """
     def __init__(self, value):
         mex.warning("FStrings are not yet implemented")
-        super().__init__(value, False)
+        super().__init__(value)
 
     def __str__(self):
         return self.value
@@ -256,9 +320,18 @@ class List(Value):
     """
     List
     """
+    # Set for values bound only to the variable, which created them by +=
+    owned = False
+
     def __init__(self, value):
         self.value = value
-        self.og = deepcopy(value)
+
+    def extend(self, items):
+        """
+        Appends items in place
+        Only owned values can be changed
+        """
+        self.value.extend(items)
 
     def _at(self, index):
         if type(index) != Int:
@@ -287,13 +360,6 @@ class List(Value):
                 return True
         return False
 
-    def update(self):
-        for c, x in enumerate(self.og):
-            if type(x) == str or type(x) == list:
-                self.value[c] = symb_table.get(x)
-            else:
-                x.update()
-
     def __eq__(self, other):
         if type(other) != List:
             return False
@@ -329,50 +395,62 @@ class List(Value):
 class Dict(Value):
     """
     Dictionary
+    Pairs are kept in insertion order in value, lookups go through index,
+    which maps hashable key values to their values
     """
-    def __init__(self, value):
-        self.value = value
-        self.og = deepcopy(value)
+    def __init__(self, value=None):
+        self.value = value if value is not None else []
+        self.index = None
+        self.unhashable = None
+
+    def build_index(self):
+        """
+        Creates hash table from the pairs, keys with unhashable values
+        (Lists and Dicts) are kept aside and searched linearly
+        """
+        self.index = {}
+        self.unhashable = []
+        for k, v in self.value:
+            a = k.get_value() if type(k) != list else k
+            try:
+                if a not in self.index:
+                    self.index[a] = v
+            except TypeError:
+                self.unhashable.append((a, v))
+
+    def lookup(self, x):
+        """
+        @return Tuple (found, value)
+        """
+        if self.index is None:
+            self.build_index()
+        v = x.get_value() if type(x) != list else x
+        try:
+            if v in self.index:
+                return True, self.index[v]
+        except TypeError:
+            for a, k in self.unhashable:
+                if a == v:
+                    return True, k
+        return False, None
 
     def _at(self, index):
-        v = index.get_value() if type(index) != list else index
-        for i, k in self.value:
-            if type(i) == str:
-                i = symb_table.get(i)
-            a = i.get_value() if type(i) != list else i
-            if a == v:
-                return k
-        raise mex.KeyError(str(index))
+        found, v = self.lookup(index)
+        if not found:
+            raise mex.KeyError(str(index))
+        return v
 
     def _in(self, x):
-        v = x.get_value() if type(x) != list else x
-        for i, _ in self.value:
-            if type(i) == str or type(i) == list:
-                i = symb_table.get(i)
-            a = i.get_value() if type(i) != list else i
-            if a == v:
-                return True
-        return False
+        return self.lookup(x)[0]
 
     def __eq__(self, other):
+        if type(other) != Dict:
+            return False
         return self.value == other.value
 
     def items(self):
         return List([List([x, y]) for x, y in self.value])
 
-    def update(self):
-        for c, i in enumerate(self.og):
-            k, v = i
-            if type(k) == str or type(k) == list:
-                k = symb_table.get(k)
-            else:
-                k.update()
-            if type(v) == str or type(v) == list:
-                v = symb_table.get(v)
-            else:
-                v.update()
-            self.value[c] = (k, v)
-
     def __str__(self):
         if len(self.value) == 0:
             return "{,}"
@@ -517,6 +595,16 @@ def vardump(var, indent=0):
         return "space "+var.name+"(\n"+(",\n".join(r))+"\n"+("    "*indent)+"})"
     return var.ir_str()
 
+def share(v):
+    """
+    Marks value as referred to from another place than the variable
+    it was read from, so it is no longer changed in place
+    @return The value
+    """
+    if (type(v) is List or type(v) is String) and v.owned:
+        v.owned = False
+    return v
+
 def wrap_py(value):
     from ir import Fun
     if type(value) == list and len(value) > 0 and type(value[0]) == Fun: return value
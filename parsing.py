@@ -5,7 +5,160 @@ from debugging import info, debug
 import mash_exceptions as mex
 from symbol_table import SymbTable
 from mash_parser import Lark_StandAlone, Transformer, Token, Tree
+from pathlib import Path
+import hashlib
+import os
+import pickle
 import re
+import shutil
+import stat
+
+# Folder for the cache, can be changed by MASH_CACHE environment variable
+CACHE_BASE = Path(os.environ.get("MASH_CACHE", Path.home() / ".cache" / "mash"))
+# Folder created by mash inside of it, nothing outside of it is ever removed
+CACHE_DIR = CACHE_BASE / "mash-cache-v1"
+# Marker of the cache folder, see https://bford.info/cachedir/
+CACHE_TAG = "CACHEDIR.TAG"
+CACHE_TAG_TEXT = "Signature: 8a477f597d28d172789f06886806bc55\n# Cache of the Mash interpreter\n"
+# Limits of entries kept for one interpreter version, least recently used ones are removed
+CACHE_ENTRIES = 512
+CACHE_SIZE = 64 * 1024 * 1024
+# Names of folders of interpreter versions
+CACHE_NAMES = re.compile(r"[0-9a-f]{16}")
+
+_interpreter_hash = None
+_cache_usable = None
+_pruned = False
+_lark = None
+
+def lark_parser():
+    """
+    Parser of mash grammar shared by all Parser objects,
+    the grammar tables are deserialized on the first use only
+    """
+    global _lark
+    if _lark is None:
+        _lark = Lark_StandAlone()
+    return _lark
+
+def interpreter_hash():
+    """
+    Hash of interpreter version and sources, including libmash.py,
+    so that cache is invalidated when the interpreter changes
+    """
+    global _interpreter_hash
+    if _interpreter_hash is None:
+        from mash import __version__
+        h = hashlib.sha256(__version__.encode("utf-8"))
+        for f in sorted(Path(__file__).parent.glob("*.py")):
+            with open(f, "rb") as src:
+                h.update(src.read())
+        _interpreter_hash = h.hexdigest()
+    return _interpreter_hash
+
+def cache_usable():
+    """
+    Creates the cache folder on the first use. Cached objects are unpickled,
+    so the folder is used only if it is not a link, belongs to the current
+    user and nobody else can access it
+    @return If the cache can be used
+    """
+    global _cache_usable
+    if _cache_usable is None:
+        _cache_usable = False
+        try:
+            CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+            st = os.lstat(CACHE_DIR)
+            if not stat.S_ISDIR(st.st_mode):
+                return False
+            if os.name == "posix" and (st.st_uid != os.getuid() or st.st_mode & 0o077 != 0):
+                return False
+            tag = CACHE_DIR / CACHE_TAG
+            if not tag.exists():
+                tag.write_text(CACHE_TAG_TEXT, encoding="utf-8")
+            _cache_usable = True
+        except Exception:
+            pass
+    return _cache_usable
+
+def cache_dir():
+    """
+    @return Folder of cached objects for this interpreter version
+    """
+    return CACHE_DIR / interpreter_hash()[:16]
+
+def cache_file(code, kind="tree"):
+    """
+    @param kind Kind of the cached object
+    @return Path of cached object for code
+    """
+    h = hashlib.sha256(interpreter_hash().encode("utf-8"))
+    h.update(code.encode("utf-8"))
+    return cache_dir() / (h.hexdigest()+"."+kind)
+
+def cache_load(path):
+    """
+    @return Cached object or None if there is none
+    """
+    if not cache_usable():
+        return None
+    try:
+        with open(path, "rb") as f:
+            obj = pickle.load(f)
+        # Modification time marks the last use for pruning
+        os.utime(path)
+        return obj
+    except Exception:
+        # Missing, unreadable or incompatible entry is created again
+        return None
+
+def cache_prune():
+    """
+    Removes entries of other interpreter versions and least recently
+    used entries over the limits
+    """
+    current = cache_dir()
+    for p in CACHE_DIR.iterdir():
+        if p != current and CACHE_NAMES.fullmatch(p.name) and p.is_dir():
+            shutil.rmtree(p, ignore_errors=True)
+    entries = []
+    for p in current.iterdir():
+        if p.suffix != ".tmp":
+            st = p.stat()
+            entries.append((st.st_mtime, st.st_size, p))
+    entries.sort(reverse=True)
+    size = 0
+    for c, (_, s, p) in enumerate(entries):
+        size += s
+        if c >= CACHE_ENTRIES or size > CACHE_SIZE:
+            p.unlink(missing_ok=True)
+
+def cache_store(path, obj):
+    """
+    Saves object into the cache, failures are ignored
+    """
+    global _pruned
+    if not cache_usable():
+        return
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(mode=0o700, exist_ok=True)
+        with open(tmp, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Other runs never see partially written entry
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            tmp.unlink()
+        except Exception:
+            pass
+    if not _pruned:
+        # Once per run, only runs adding entries can exceed the limits
+        _pruned = True
+        try:
+            cache_prune()
+        except Exception:
+            pass
 
 class Parser(Mash):
     """
@@ -22,39 +175,53 @@ class Parser(Mash):
         #with open("grammars/mash_lalr.lark", "r") as gfile:
         #    grammar = gfile.read()
         #self.parser = Lark(grammar, start="start", parser="lalr")
-        self.parser = Lark_StandAlone()
-    
+
     def parse(self, main=False):
         """
         Parses mash code
         """
-        # Parse the source code for notebook output
-        #note_pattern = r'n""".*(?:\n?.)+\n*"""'
-        note_pattern = r'n""".*?"""'
         if main and self.opts.output is not None:
-            matches = re.finditer(note_pattern, self.code, re.MULTILINE | re.DOTALL)
-            start = 0
-            end = 0
-            for match in matches:
-                end = match.start()
-                self.code_blocks.append(self.code[start:end])
-                start = match.end()
-            self.code_blocks.append(self.code[start:])
-            self.code_blocks = list(reversed(self.code_blocks))
-#            if len(self.code) > 6 and self.code[:4] == "n\"\"\"":
-#                self.code_blocks.append("")
-
-        parse_tree = self.parser.parse(self.code)
+            self.split_blocks()
+        cache = not self.opts.no_cache
+        parse_tree = cache_load(cache_file(self.code)) if cache else None
+        if parse_tree is None:
+            parse_tree = lark_parser().parse(self.code)
+            if cache:
+                cache_store(cache_file(self.code), parse_tree)
         if self.opts.verbose:
             info(parse_tree.pretty(), self.opts)
         return parse_tree
 
+    def split_blocks(self):
+        """
+        Splits source code by notes into code blocks for notebook output
+        """
+        #note_pattern = r'n""".*(?:\n?.)+\n*"""'
+        note_pattern = r'n""".*?"""'
+        matches = re.finditer(note_pattern, self.code, re.MULTILINE | re.DOTALL)
+        start = 0
+        end = 0
+        for match in matches:
+            end = match.start()
+            self.code_blocks.append(self.code[start:end])
+            start = match.end()
+        self.code_blocks.append(self.code[start:])
+        self.code_blocks = list(reversed(self.code_blocks))
+#        if len(self.code) > 6 and self.code[:4] == "n\"\"\"":
+#            self.code_blocks.append("")
+
+# Characters of escape sequences in string literals
+ESCAPES = {"n": "\n", "t": "\t", "\"": "\"", "a": "\a", "b": "\b", "f": "\f", "r": "\r", "v": "\v"}
+ESCAPE_RE = re.compile(r'\\([ntabfrv"])')
+
 class ConstTransformer(Transformer):
     """
     Tree transformer
     """
 
     CONSTS = {"SIGNED_INT", "SIGNED_FLOAT", "nil", "true", "false", "string", "list", "dict"}
+    # Token types for folded values, booleans use their value
+    FOLDED = {types.Int: "SIGNED_INT", types.Float: "SIGNED_FLOAT", types.Nil: "nil", types.String: "string"}
 
     def __init__(self, symb_table):
         """
@@ -64,6 +231,15 @@ class ConstTransformer(Transformer):
         self._last_id = 0
         self.insts = []
 
+    @staticmethod
+    def unescape(s):
+        """
+        Decodes escape sequences of a string literal
+        """
+        if "\\" not in s:
+            return s
+        return ESCAPE_RE.sub(lambda m: ESCAPES[m.group(1)], s)
+
     def uniq_var(self):
         self._last_id += 1
         return f"'ct_{self._last_id}"
@@ -127,7 +303,7 @@ class ConstTransformer(Transformer):
 
     def xstring(self, items):
         if items[0].value == "r":
-            return Token("string", types.String(items[1].value, escape_chs=False))
+            return Token("string", types.String(items[1].value))
         elif items[0].value == "f":
             raise mex.Unimplemented("fStrings")
         elif items[0].value == "n":
@@ -141,7 +317,7 @@ class ConstTransformer(Transformer):
                 v = items[1].value[4:-3]
             else:
                 v = items[1].value[3:-3]
-            return Token("note", ("n", types.String(v, escape_chs=True)))
+            return Token("note", ("n", types.String(ConstTransformer.unescape(v))))
         elif items[0].value == "d" or items[0].value == "doc":
             start = 3
             end = -3
@@ -157,7 +333,7 @@ class ConstTransformer(Transformer):
                     vl.pop()
                     continue
                 vl[c] = l.lstrip()
-            return Token("note", ("d", types.String("\n".join(vl), escape_chs=True)))
+            return Token("note", ("d", types.String(ConstTransformer.unescape("\n".join(vl)))))
         else:
             raise mex.SyntaxError(f"Unsupported note prefix '{items[0].value}'")
 
@@ -186,35 +362,38 @@ class ConstTransformer(Transformer):
         return Token("false", types.Bool(False))
 
     def string(self, items):
-        return Token("string", types.String(items[0].value[1:-1]))
+        original = items[0].value[1:-1]
+        v = ConstTransformer.unescape(original)
+        return Token("string", types.String(v, original if v != original else None))
 
     def hex_int(self, items):
         return Token("SIGNED_INT", types.Int(int(items[0].value, base=16)))
 
+    def _element(self, x, code):
+        """
+        Generates code for element of a list or dict literal
+        @return Operand holding the element
+        """
+        if type(x) == Token:
+            if x.type == "CODE":
+                code += x.value
+                return code[-1].dst
+            return x.value
+        d = self.uniq_var()
+        code += [x, ir.AssignVar(d, SymbTable.RETURN_NAME)]
+        return d
+
     def list(self, items):
         v = []
         code = []
         for x in items:
-            if type(x) == Token:
-                if x.type == "CODE":
-                    code += x.value
-                    v.append(code[-1].dst)
-                elif x.type == "CALC":
-                    code += x.value[0].value
-                    d = self.uniq_var()
-                    val = x.value[1].value.get_value()
-                    code.append(ir.AssignVar(d, types.List(val)))
-                    v.append(d)
-                else:
-                    v.append(x.value)
-            else:
-                d = self.uniq_var()
-                code += [items[0], ir.AssignVar(d, SymbTable.RETURN_NAME)]
-                v.append(d)
-        if len(code) == 0:
+            v.append(self._element(x, code))
+        if len(code) == 0 and all(issubclass(type(x), types.Value) for x in v):
             return Token("list", types.List(v))
-        else:
-            return Token("CALC", [Token("CODE", code), Token("list", types.List(v))])
+        # Elements are evaluated into a new list each time
+        d = self.uniq_var()
+        code.append(ir.BuildList(d, v))
+        return Token("CODE", code)
     
     def arg_list(self, items):
         if len(items) > 2:
@@ -275,48 +454,38 @@ class ConstTransformer(Transformer):
     def dict(self, items):
         v = []
         code = []
-        i = 0
-        while i < len(items):
-            x = items[i]
-            y = items[i+1]
-            if type(x) == Token:
-                if x.type == "CODE":
-                    code += x.value
-                    x = code[-1].dst
-                elif x.type == "CALC":
-                    code += x.value[0].value
-                    d = self.uniq_var()
-                    val = x.value[1].value
-                    code.append(ir.AssignVar(d, val))
-                    x = d
-                else:
-                    x = x.value
-            else:
-                d = self.uniq_var()
-                code += [items[0], ir.AssignVar(d, SymbTable.RETURN_NAME)]
-                x = d
-            if type(y) == Token:
-                if y.type == "CODE":
-                    code += y.value
-                    y = code[-1].dst
-                elif y.type == "CALC":
-                    code += y.value[0].value
-                    d = self.uniq_var()
-                    val = y.value[1].value
-                    code.append(ir.AssignVar(d, val))
-                    y = d
-                else:
-                    y = y.value
-            else:
-                d = self.uniq_var()
-                code += [items[0], ir.AssignVar(d, SymbTable.RETURN_NAME)]
-                y = d
-            i += 2
+        for i in range(0, len(items), 2):
+            x = self._element(items[i], code)
+            y = self._element(items[i+1], code)
             v.append((x, y))
-        if len(code) == 0:
+        if len(code) == 0 and all(issubclass(type(x), types.Value) and issubclass(type(y), types.Value) for x, y in v):
             return Token("dict", types.Dict(v))
-        else:
-            return Token("CALC", [Token("CODE", code), Token("dict", types.Dict(v))])
+        # Pairs are evaluated into a new dict each time
+        d = self.uniq_var()
+        code.append(ir.BuildDict(d, v))
+        return Token("CODE", code)
+
+    def _fold(self, items, Cls):
+        """
+        Evaluates operator on constant operands the same way as it
+        would be evaluated at runtime
+        @return Token with the result or None if it cannot be folded
+        """
+        values = []
+        for i in items:
+            if type(i) != Token or i.type not in ConstTransformer.CONSTS or type(i.value) not in ir.CONST_TYPES:
+                return None
+            values.append(i.value)
+        try:
+            r = Cls(*values, None).eval(*values)
+        except Exception:
+            # Errors are reported at runtime
+            return None
+        if type(r) == types.Bool:
+            return Token(str(r), r)
+        if type(r) not in ConstTransformer.FOLDED:
+            return None
+        return Token(ConstTransformer.FOLDED[type(r)], r)
 
     def _help_expr_bin(self, items, op, Cls, post):
         i1 = items[0]
@@ -335,12 +504,9 @@ class ConstTransformer(Transformer):
             return Tree("EXPR_"+post, [i1, i2])
             
         # Evaluating const expr
-        if (i1.type == "SIGNED_INT" or i1.type == "SIGNED_FLOAT") and (i2.type == "SIGNED_INT" 
-                or i2.type == "SIGNED_FLOAT"):
-            if(i1.type == "SIGNED_FLOAT" or i2.type == "SIGNED_FLOAT"):
-                return Token("SIGNED_FLOAT", ir.Float(op(i1.value.value, i2.value.value)))
-            else:
-                return Token("SIGNED_INT", ir.Int(op(i1.value.value, i2.value.value)))
+        folded = self._fold(items, Cls)
+        if folded is not None:
+            return folded
         # Generating code
         insts = []
         srcs = [0, 0]
@@ -362,7 +528,7 @@ class ConstTransformer(Transformer):
         insts.append(Cls(srcs[0], srcs[1], self.uniq_var()))
         return Token("CODE", insts)
 
-    def _help_expr_log(self, items, op, Cls, post):
+    def _help_expr_log(self, items, op, Cls, post, short=None):
         i1 = items[0]
         i2 = items[1]
 
@@ -378,13 +544,16 @@ class ConstTransformer(Transformer):
         if type(i2) == Tree and i2.data == "fun_call":
             return Tree("EXPR_"+post, [i1, i2])
 
-        if type(items[0].value) == ir.Bool and type(items[1].value) == ir.Bool:
-            r = ir.Bool(op(items[0].value.value, items[1].value.value))
-            return Token(str(r), r)
+        folded = self._fold(items, Cls)
+        if folded is not None:
+            return folded
         # Generating code
         insts = []
         srcs = [0, 0]
+        # Where code of the right operand starts
+        right_i = 0
         for i in range(0, 2):
+            right_i = len(insts)
             if items[i].type == "CODE":
                 insts += items[i].value
                 # Expr code
@@ -400,7 +569,11 @@ class ConstTransformer(Transformer):
                 srcs[i] = insts[-1].dst
             else:
                 srcs[i] = items[i].value
-        insts.append(Cls(srcs[0], srcs[1], self.uniq_var()))
+        expr = Cls(srcs[0], srcs[1], self.uniq_var())
+        if short is not None and right_i < len(insts):
+            # Right operand is evaluated only if the left one does not decide
+            return Token("CODE", insts[:right_i]+[ir.ShortCircuit(expr, insts[right_i:], short)])
+        insts.append(expr)
         return Token("CODE", insts)
 
     def _help_expr_log_un(self, items, op, Cls, post):
@@ -409,9 +582,9 @@ class ConstTransformer(Transformer):
             return Tree("EXPR_"+post, [i1])
         if type(i1) == Tree and i1.data == "fun_call":
             return Tree("EXPR_"+post, [i1])
-        if type(items[0].value) == ir.Bool:
-            r = ir.Bool(op(items[0].value.value))
-            return Token(str(r), r)
+        folded = self._fold(items, Cls)
+        if folded is not None:
+            return folded
         # Generating code
         insts = []
         src = None
@@ -439,12 +612,9 @@ class ConstTransformer(Transformer):
             return Tree("EXPR_"+post, [i1])
         if type(i1) == Tree and i1.data == "fun_call":
             return Tree("EXPR_"+post, [i1])
-        if type(items[0].value) == ir.Int:
-            r = ir.Int(op(items[0].value.value))
-            return Token(str(r), r)
-        elif type(items[0].value) == ir.Float:
-            r = ir.Float(op(items[0].value.value))
-            return Token(str(r), r)
+        folded = self._fold(items, Cls)
+        if folded is not None:
+            return folded
         # Generating code
         insts = []
         src = None
@@ -503,9 +673,9 @@ class ConstTransformer(Transformer):
         if type(i2) == Tree and i2.data == "fun_call":
             return Tree("EXPR_CAT", [i1, i2])
 
-        #if type(items[0].value) == ir.String and type(items[1].value) == ir.String:
-        #    r = ir.String(items[0].value.value + items[1].value.value)
-        #    return Token(str(r), r)
+        folded = self._fold(items, ir.Cat)
+        if folded is not None:
+            return folded
         # Generating code
         insts = []
         srcs = [0, 0]
@@ -529,16 +699,16 @@ class ConstTransformer(Transformer):
         return Token("CODE", insts)
 
     def expr_lor(self, items):
-        return self._help_expr_log(items, lambda a, b: a or b, ir.LOr, "LOR")
+        return self._help_expr_log(items, lambda a, b: a or b, ir.LOr, "LOR", True)
 
     def expr_land(self, items):
-        return self._help_expr_log(items, lambda a, b: a and b, ir.LAnd, "LAND")
+        return self._help_expr_log(items, lambda a, b: a and b, ir.LAnd, "LAND", False)
 
     def expr_or(self, items):
-        return self._help_expr_log(items, lambda a, b: a or b, ir.Or, "OR")
+        return self._help_expr_log(items, lambda a, b: a or b, ir.Or, "OR", True)
 
     def expr_and(self, items):
-        return self._help_expr_log(items, lambda a, b: a and b, ir.And, "AND")
+        return self._help_expr_log(items, lambda a, b: a and b, ir.And, "AND", False)
 
     def expr_lte(self, items):
         return self._help_expr_log(items, lambda a, b: a <= b, ir.Lte, "LTE")
@@ -574,6 +744,9 @@ class ConstTransformer(Transformer):
         if type(i2) == Tree and i2.data == "fun_call":
             return Tree("EXPR_IN", [i1, i2])
 
+        folded = self._fold(items, ir.In)
+        if folded is not None:
+            return folded
         # Generating code
         insts = []
         srcs = [0, 0]
@@ -619,17 +792,26 @@ class ConstTransformer(Transformer):
         if type(f) == Tree and f.data == "fun_call":
             return Tree("EXPR_TIF", [cnd, t, f])
 
+        if type(cnd) == Token and cnd.type in ConstTransformer.CONSTS and type(cnd.value) in ir.CONST_TYPES:
+            # Only the taken branch is needed
+            return t if cnd.value.get_value() else f
+
         # Generating code
-        insts = []
+        parts = [[], [], []]
         srcs = [0, 0, 0]
         for i in range(0, 3):
             if items[i].type == "CODE":
-                insts += items[i].value
+                parts[i] = items[i].value
                 # Expr code
                 srcs[i] = items[i].value[-1].dst
             else:
                 srcs[i] = items[i].value
-        insts.append(ir.TernaryIf(srcs[0], srcs[1], srcs[2], self.uniq_var()))
+        insts = list(parts[0])
+        if len(parts[1]) > 0 or len(parts[2]) > 0:
+            # Only the taken branch is evaluated
+            insts.append(ir.LazyTernaryIf(srcs[0], parts[1], srcs[1], parts[2], srcs[2], self.uniq_var()))
+        else:
+            insts.append(ir.TernaryIf(srcs[0], srcs[1], srcs[2], self.uniq_var()))
         return Token("CODE", insts)
 
     def expr_not(self, items):
@@ -0,0 +1,526 @@
+"""
+Optimization passes over lowered (flat) ir
+"""
+from copy import copy
+import ir
+from ir import (AssignVar, Print, SetIfNotSet, SetOrPrint, Expr, TernaryIf, Fun, FunCall, Return,
+                Nop, Jump, JumpIfNot, JumpIf, JumpIfFalsy, JumpShort, PushFrame, PopFrame, Lowering,
+                FDiv, Exp, Lt, Lte, Gt, Gte, Eq, Neq, CONST_TYPES, successors)
+from mash_types import Value, Bool, Nil, Int, Float, String, IMPLICIT_TO_BOOL
+import mash_exceptions as mex
+
+# Instruction attributes set by passes and resolution, which hold no operands
+ANNOTATIONS = {"depths", "regs", "known"}
+
+def is_temp(name):
+    """
+    Checks if name is a temporary generated by the code generation
+    """
+    return type(name) == str and len(name) > 0 and name[0] == "'"
+
+def write_counts(code, counts):
+    """
+    Counts writes of names in flat code
+    @return False if some instruction writes unknown names
+    """
+    for inst in code:
+        if type(inst) in {SetIfNotSet, SetOrPrint}:
+            # These write only names, which are not yet set
+            continue
+        w = inst.writes()
+        if w is None:
+            return False
+        for name in w:
+            if type(name) == list:
+                name = name[-1]
+            counts[name] = counts.get(name, 0)+1
+    return True
+
+def program_writes(code, counts):
+    """
+    Counts writes of names in bodies of functions defined in flat code
+    @return False if some instruction writes unknown names
+    """
+    for inst in code:
+        if issubclass(type(inst), Fun) and type(inst.body) == list:
+            lw = Lowering()
+            lw.block(inst.body)
+            if not write_counts(lw.code, counts) or not program_writes(lw.code, counts):
+                return False
+    return True
+
+def mentions(obj, names):
+    """
+    Collects all names mentioned in instruction attributes
+    """
+    if type(obj) == str:
+        names.add(obj)
+    elif type(obj) == list or type(obj) == tuple:
+        for i in obj:
+            mentions(i, names)
+    elif type(obj) == dict:
+        for k, v in obj.items():
+            mentions(k, names)
+            mentions(v, names)
+    elif issubclass(type(obj), Value):
+        if type(obj.value) in {list, tuple, dict}:
+            mentions(obj.value, names)
+    elif issubclass(type(obj), ir.IR):
+        for k, v in vars(obj).items():
+            if k not in ANNOTATIONS and not issubclass(type(v), ir.IR):
+                mentions(v, names)
+
+def substitute(inst, values):
+    """
+    Replaces operands of instruction
+    @param values Replacements for names read by the instruction
+    @return Instruction with replaced operands or the same one
+    """
+    changed = {}
+    for a in inst.OPERANDS:
+        v = getattr(inst, a)
+        if type(v) == str and v in values:
+            changed[a] = values[v]
+    if len(changed) == 0:
+        return inst
+    if type(inst) == AssignVar:
+        if inst.skip:
+            return inst
+        return AssignVar(inst.dst, changed["value"])
+    inst = copy(inst)
+    for a, v in changed.items():
+        setattr(inst, a, v)
+    return inst
+
+def fold(inst):
+    """
+    Evaluates operation on constant operands
+    @return Constant result or None if it cannot be evaluated
+    """
+    values = [getattr(inst, a) for a in inst.OPERANDS]
+    for v in values:
+        if type(v) not in CONST_TYPES:
+            return None
+    try:
+        r = inst.eval(*values)
+    except Exception:
+        # Errors are reported at runtime
+        return None
+    if type(r) not in CONST_TYPES:
+        return None
+    return r
+
+def propagate_constants(lw, program=False):
+    """
+    Propagates constants assigned to names, which are written only once,
+    into instructions following the assignment and folds operations,
+    which have only constant operands.
+    Temporaries are propagated always, variables only in a program,
+    where assignment at depth 0 precedes all other code it could affect.
+    """
+    code = lw.code
+    counts = {}
+    if not write_counts(code, counts):
+        return
+    if program:
+        # Functions can change variables when called
+        program = program_writes(code, counts)
+    consts = {}
+    for pc, inst in enumerate(code):
+        if type(inst) == SetOrPrint and type(inst.dst) == str and inst.dst in consts:
+            # Variable is set, so it would be printed
+            inst = Print(consts[inst.dst], output_file=inst.output_file, output_format=inst.output_format)
+        else:
+            inst = substitute(inst, consts)
+        code[pc] = inst
+        value = None
+        if type(inst) == AssignVar and not inst.skip:
+            if type(inst.value) in CONST_TYPES:
+                value = inst.value
+        elif issubclass(type(inst), Expr) and type(inst) != TernaryIf:
+            value = fold(inst)
+            if value is not None:
+                inst = AssignVar(inst.dst, value)
+                code[pc] = inst
+        elif type(inst) in {JumpIfNot, JumpIf} and type(inst.cnd) in {Bool, Nil}:
+            taken = bool(inst.cnd.get_value())
+            if type(inst) == JumpIfNot:
+                taken = not taken
+            code[pc] = Jump(inst.target) if taken else Nop()
+        if value is None or type(inst.dst) != str or counts.get(inst.dst) != 1:
+            continue
+        if is_temp(inst.dst) or (program and lw.depths[pc] == 0 and not lw.opaques[pc]):
+            consts[inst.dst] = value
+
+def propagate_copies(lw, program=False):
+    """
+    Replaces reads of temporaries holding copy of a variable with
+    the variable itself, until the block ends or the variable might change
+    """
+    code = lw.code
+    counts = {}
+    if not write_counts(code, counts):
+        return
+    targets = set()
+    for pc, inst in enumerate(code):
+        for s in successors(inst, pc):
+            if s != pc+1:
+                targets.add(s)
+    for pc, inst in enumerate(code):
+        if type(inst) != AssignVar or inst.skip or not is_temp(inst.dst) or counts.get(inst.dst) != 1:
+            continue
+        src = inst.value
+        if type(src) != str or is_temp(src):
+            continue
+        values = {inst.dst: src}
+        for i in range(pc+1, len(code)):
+            if i in targets:
+                break
+            code[i] = substitute(code[i], values)
+            nxt = code[i]
+            if type(nxt) in {FunCall, PushFrame, PopFrame} or issubclass(type(nxt), Fun):
+                break
+            w = nxt.writes()
+            if w is None or src in [n[-1] if type(n) == list else n for n in w]:
+                break
+            if successors(nxt, i) != [i+1]:
+                break
+
+def remove_dead_stores(lw, program=False):
+    """
+    Removes assignments to temporaries, which are never read
+    """
+    code = lw.code
+    used = set()
+    for inst in code:
+        if type(inst) == AssignVar and is_temp(inst.dst):
+            mentions(inst.value, used)
+        else:
+            mentions(inst, used)
+    for pc, inst in enumerate(code):
+        if type(inst) == AssignVar and is_temp(inst.dst) and inst.dst not in used:
+            code[pc] = Nop()
+
+def remove_nops(lw, program=False):
+    """
+    Removes instructions doing nothing and retargets jumps
+    """
+    code = lw.code
+    keep = []
+    for pc, inst in enumerate(code):
+        if type(inst) == Nop or (type(inst) == AssignVar and inst.skip):
+            continue
+        if type(inst) == Jump and inst.target == pc+1 and inst.pops == 0:
+            continue
+        keep.append(pc)
+    if len(keep) == len(code):
+        return
+    # New position for every old one, removed ones go to the following instruction
+    moved = []
+    i = 0
+    for pc in range(len(code)+1):
+        while i < len(keep) and keep[i] < pc:
+            i += 1
+        moved.append(i)
+    lw.code = [code[pc] for pc in keep]
+    lw.depths = [lw.depths[pc] for pc in keep]
+    lw.opaques = [lw.opaques[pc] for pc in keep]
+    for pc, inst in enumerate(lw.code):
+        if getattr(inst, "target", None) is not None:
+            inst = copy(inst)
+            inst.target = moved[inst.target]
+            lw.code[pc] = inst
+    # Jumps could now lead to the following instruction
+    remove_nops(lw, program)
+
+def result_type(inst, operands):
+    """
+    Type of numeric operation result
+    @param operands Types of the operands
+    @return Result type or None if it depends on the values
+    """
+    if type(inst) in {Lt, Lte, Gt, Gte, Eq, Neq}:
+        return Bool
+    if type(inst) == Exp:
+        # Negative exponent of Int gives Float
+        return None
+    if type(inst) == FDiv or Float in operands:
+        return Float
+    return Int
+
+def sample(t):
+    """
+    @return Value of type t used to check operations on this type
+    """
+    if t == Int:
+        return Int(1)
+    elif t == Float:
+        return Float(1.0)
+    elif t == Bool:
+        return Bool(True)
+    elif t == String:
+        return String("1")
+    return Nil()
+
+def static_error(inst, operands):
+    """
+    Checks operation on values of known types
+    @param operands Types of the operands
+    @return Type error the operation raises for any such values or None
+    """
+    values = [sample(t) for t in operands]
+    if issubclass(type(inst), JumpIfNot):
+        if type(inst) != JumpIfFalsy and type(values[0]) != Bool and type(values[0]) not in IMPLICIT_TO_BOOL:
+            return mex.TypeError(f"Unexpected expression type '{values[0].type_name()}' in {inst.stmt} statement condition")
+        return None
+    try:
+        inst.eval(*values)
+    except mex.TypeError as e:
+        msg = e.msg
+        names = " and ".join(f"'{v.type_name()}'" for v in values)
+        if len(values) == 1:
+            return mex.TypeError(f"{msg}. Operand is always of type {names}")
+        return mex.TypeError(f"{msg}. Operands are always of types {names}")
+    except Exception:
+        # Other errors depend on the values
+        pass
+    return None
+
+def always_run(code, pc):
+    """
+    Checks if instruction is run whenever the code is, which is the case
+    when the code cannot end nor call anything without running it first.
+    Instruction, which cannot be reached at all, is never run
+    """
+    seen = {0}
+    work = [0]
+    reached = False
+    while len(work) > 0:
+        i = work.pop()
+        if i == pc:
+            reached = True
+            continue
+        if i >= len(code) or type(code[i]) in {Return, FunCall}:
+            return False
+        for t in successors(code[i], i):
+            if t not in seen:
+                seen.add(t)
+                work.append(t)
+    return reached
+
+def infer_types(lw, program=False):
+    """
+    Infers types of names at each instruction from constants, declared
+    argument types and results of operations. Numeric operations and
+    conditions with known operand types are marked, so that they are
+    compiled without checking the types. Operations, which fail for
+    the known types and are always run, are reported before the code is.
+    Names written by nested functions are never inferred
+    """
+    code = lw.code
+    if len(code) == 0:
+        return
+    own = {}
+    if not write_counts(code, own):
+        return
+    counts = dict(own)
+    if not program_writes(code, counts):
+        return
+    nested = {n for n, c in counts.items() if c != own.get(n, 0)}
+
+    def operand_types(inst, state):
+        operands = []
+        for a in inst.OPERANDS:
+            v = getattr(inst, a)
+            if type(v) == str and v in state:
+                operands.append(state[v][0])
+            elif type(v) in CONST_TYPES:
+                operands.append(type(v))
+            else:
+                return None
+        return operands
+
+    def transfer(pc, state):
+        inst = code[pc]
+        if type(inst) in {SetIfNotSet, SetOrPrint}:
+            # Known names are set and so not written
+            return state
+        state = dict(state)
+        typ = None
+        if not lw.opaques[pc] and type(getattr(inst, "dst", None)) == str:
+            if type(inst) == AssignVar and not inst.skip:
+                if type(inst.value) == str and inst.value in state:
+                    typ = state[inst.value][0]
+                elif type(inst.value) in CONST_TYPES:
+                    typ = type(inst.value)
+            elif issubclass(type(inst), Expr) and type(inst) != TernaryIf:
+                operands = operand_types(inst, state)
+                if operands is not None and static_error(inst, operands) is None:
+                    if type(inst) in {Lt, Lte, Gt, Gte, Eq, Neq}:
+                        typ = Bool
+                    elif inst.FAST is not None and set(operands) <= {Int, Float}:
+                        typ = result_type(inst, operands)
+        for name in inst.writes():
+            if type(name) == list:
+                name = name[-1]
+            if name in state:
+                depth = state[name][1]
+            else:
+                depth = lw.depths[pc]
+            state.pop(name, None)
+            if typ is not None and name not in nested:
+                state[name] = (typ, depth)
+        return state
+
+    def join(a, b):
+        return {n: t for n, t in a.items() if b.get(n) == t}
+
+    states = [None]*len(code)
+    states[0] = {n: (t, 0) for n, t in lw.types.items() if n not in nested}
+    work = [0]
+    while len(work) > 0:
+        pc = work.pop()
+        out = transfer(pc, states[pc])
+        for t in successors(code[pc], pc):
+            if t >= len(code):
+                continue
+            # Names in popped frames are no longer accessible
+            d = lw.depths[t]
+            out_t = {n: v for n, v in out.items() if v[1] <= d}
+            new = out_t if states[t] is None else join(states[t], out_t)
+            if new != states[t]:
+                states[t] = new
+                work.append(t)
+
+    for pc, inst in enumerate(code):
+        if states[pc] is None or lw.opaques[pc]:
+            continue
+        checked = issubclass(type(inst), Expr) and type(inst) != TernaryIf
+        if not checked and not issubclass(type(inst), JumpIfNot):
+            continue
+        operands = operand_types(inst, states[pc])
+        if operands is None:
+            continue
+        err = static_error(inst, operands)
+        if err is not None:
+            if always_run(code, pc):
+                raise err
+            continue
+        if set(operands) <= {Int, Float} and checked and inst.FAST is not None:
+            inst = copy(inst)
+            inst.known = tuple(operands)+(result_type(inst, operands),)
+            code[pc] = inst
+        elif operands == [Bool] and type(inst) in {JumpIfNot, JumpIf}:
+            inst = copy(inst)
+            inst.known = Bool
+            code[pc] = inst
+
+def register_access(inst):
+    """
+    Splits names mentioned by instruction into those it accesses
+    only through its getters and setters and all others
+    """
+    accessed = set()
+    other = set()
+    compiled = type(inst) in {AssignVar, JumpIfNot, JumpIf, JumpIfFalsy, JumpShort, Return}
+    if issubclass(type(inst), Expr) and type(inst) != TernaryIf:
+        compiled = True
+    if type(inst) == AssignVar and inst.skip:
+        compiled = False
+    if not compiled:
+        mentions(inst, other)
+        return accessed, other
+    for k, v in vars(inst).items():
+        if k in ANNOTATIONS:
+            continue
+        if k in inst.OPERANDS or k == "dst":
+            if type(v) == str:
+                accessed.add(v)
+                continue
+        if not issubclass(type(v), ir.IR):
+            mentions(v, other)
+    return accessed, other
+
+def allocate_registers(lw, program=False):
+    """
+    Moves temporaries from frames into registers of the running code.
+    Register is reused once the temporary it held is no longer live
+    """
+    code = lw.code
+    spans = {}
+    unsafe = set()
+    for pc, inst in enumerate(code):
+        accessed, other = register_access(inst)
+        unsafe |= other
+        for name in accessed:
+            if not is_temp(name):
+                continue
+            if name in spans:
+                spans[name][1] = pc
+            else:
+                spans[name] = [pc, pc]
+    spans = {k: v for k, v in spans.items() if k not in unsafe}
+    # Temporaries live at start of a loop have to live through all of it
+    changed = True
+    while changed:
+        changed = False
+        for pc, inst in enumerate(code):
+            for t in successors(inst, pc):
+                if t > pc:
+                    continue
+                for span in spans.values():
+                    if span[0] < t <= span[1] < pc:
+                        span[1] = pc
+                        changed = True
+    slots = {}
+    free = []
+    live = []
+    count = 0
+    for name, (start, end) in sorted(spans.items(), key=lambda x: x[1][0]):
+        for l in [l for l in live if l[0] < start]:
+            live.remove(l)
+            free.append(l[1])
+        if len(free) > 0:
+            slot = free.pop()
+        else:
+            slot = count
+            count += 1
+        slots[name] = slot
+        live.append((end, slot))
+    for inst in code:
+        accessed, _ = register_access(inst)
+        regs = {n: slots[n] for n in accessed if n in slots}
+        inst.regs = regs if len(regs) > 0 else None
+
+class PassManager():
+    """
+    Runs optimization passes over lowered code
+    """
+
+    def __init__(self):
+        self.level = 1
+        # Prints code after each pass
+        self.show = False
+        # Passes with the lowest optimization level they are run at
+        self.passes = []
+
+    def add(self, name, run, level):
+        self.passes.append((name, run, level))
+
+    def run(self, lw, program=False):
+        for name, p, level in self.passes:
+            if self.level < level:
+                continue
+            p(lw, program)
+            if self.show:
+                print(f"# After {name}")
+                for pc, inst in enumerate(lw.code):
+                    print(str(pc).rjust(4)+"  "+str(inst).split("\n")[0])
+
+pass_manager = PassManager()
+pass_manager.add("copy propagation", propagate_copies, 2)
+pass_manager.add("constant propagation", propagate_constants, 1)
+pass_manager.add("dead store elimination", remove_dead_stores, 2)
+pass_manager.add("nop removal", remove_nops, 1)
+pass_manager.add("type inference", infer_types, 1)
+pass_manager.add("register allocation", allocate_registers, 1)
@@ -8,6 +8,10 @@ class Frame(dict):
 
     def __init__(self, shadowing=False, *args, **kwargs):
         self.shadowing = shadowing
+        # Frame bellow this one, None for the global frame
+        self.parent = None
+        # If the frame is pushed and not yet popped
+        self.live = False
         super(Frame, self).__init__(*args, **kwargs)
 
     def get_value(self):
@@ -78,45 +82,104 @@ class ClassFrame(Frame):
     def __str__(self):
         return f"<class {self.name}>"
 
+class Dispatch():
+    """
+    Dispatch table of function overloads.
+    It is kept by the functions of the overload list, so that it is freed
+    together with them, overload lists stay plain lists
+    """
+
+    def __init__(self, overloads):
+        self.overloads = overloads
+        for f in overloads:
+            f.dispatch = self
+        # Candidates for every amount of passed arguments
+        self.arities = {}
+        # Matched overloads for argument amount and types
+        self.matches = {}
+        most = 0
+        for f in overloads:
+            if f.max_args != float("inf") and f.max_args > most:
+                most = f.max_args
+        for n in range(most+2):
+            self.arities[n] = self.select(n)
+        # Only variadic functions can take more arguments than that
+        self.varargs = self.arities[most+1]
+
+    def select(self, amount):
+        """
+        Functions taking at least amount arguments,
+        the ones with more typed arguments first
+        """
+        f = [i for i in self.overloads if i.max_args >= amount]
+        f.sort(key=lambda x: sum([1 if type(a[0]) == tuple else 0 for a in x.args]), reverse=True)
+        return f
+
+    def candidates(self, amount):
+        return self.arities.get(amount, self.varargs)
+
 class SymbTable(Mash):
     """
     Symbolic table
     """
     RETURN_NAME = "$ret"
+    ITER_NAME = "$iter"
 
     def __init__(self, analyzer=False):
         self.initialize()
         self.analyzer = analyzer
 
     def initialize(self):
-        self.frames = [Frame()]
-        self.index = 0
+        self.global_frame = Frame()
+        self.global_frame.live = True
+        self.top_frame = self.global_frame
         self.shadow_depth = 0
         self.spaces = []
         self.last_exec = None
+        # Registers of the running code
+        self.regs = []
+
+    def push_frame(self, f):
+        f.parent = self.top_frame
+        f.live = True
+        self.top_frame = f
 
     def push(self, shadowing=False):
         self.last_exec = None
-        self.index += 1
         if shadowing:
             self.shadow_depth += 1
-        self.frames.insert(self.index, Frame(shadowing))
+        self.push_frame(Frame(shadowing))
 
     def pop(self, amount=1):
         self.last_exec = None
         for _ in range(amount):
-            if self.frames[self.index].shadowing:
+            f = self.top_frame
+            if f.shadowing:
                 self.shadow_depth -= 1
-            del self.frames[self.index]
-            self.index -= 1
+            f.live = False
+            self.top_frame = f.parent
 
     def move_top(self, f):
         # No need to move shadow_depth, since this is only in case of function call, which is shadowing
         # And the frame will be restored after return
-        self.index = self.frames.index(f)
+        self.top_frame = f
 
     def top(self):
-        return self.frames[self.index]
+        return self.top_frame
+
+    def in_global(self):
+        return self.top_frame is self.global_frame
+
+    def chain(self, skip_global=False):
+        """
+        Frames visible from the top frame, starting with the top one
+        """
+        f = self.top_frame
+        while f is not None:
+            if skip_global and f is self.global_frame:
+                return
+            yield f
+            f = f.parent
 
     def in_space(self):
         return len(self.spaces) > 0
@@ -130,9 +193,8 @@ class SymbTable(Mash):
         else:
             self.top()[name] = f
             self.spaces.append(f)
-        self.frames.append(f)
+        self.push_frame(f)
         self.shadow_depth += 1
-        self.index += 1
         #print(f"\nAfter pushing space {name}:", self)
         
     def pop_space(self):
@@ -149,9 +211,8 @@ class SymbTable(Mash):
         else:
             self.top()[name] = f
             self.spaces.append(f)
-        self.frames.append(f)
+        self.push_frame(f)
         self.shadow_depth += 1
-        self.index += 1
         
     def pop_class(self):
         self.last_exec = None
@@ -161,6 +222,21 @@ class SymbTable(Mash):
     def clear_all(self):
         self.initialize()
 
+    def state(self):
+        """
+        @return Frames and spaces of the table, which can be saved and restored
+        """
+        return {"global_frame": self.global_frame, "top_frame": self.top_frame,
+                "shadow_depth": self.shadow_depth, "spaces": self.spaces}
+
+    def restore(self, state):
+        """
+        Replaces frames and spaces of the table with saved state
+        """
+        self.initialize()
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def declare(self, symb, value):
         """
         Declares variable for the first time.
@@ -182,7 +258,9 @@ class SymbTable(Mash):
             fprev = fprevfr[name]
 
         if fprev is None or type(fprev) != list:
-            self.assign(name, [irfun], fun_arg=True)
+            overloads = [irfun]
+            self.assign(name, overloads, fun_arg=True)
+            Dispatch(overloads)
         else:
             # Redefinition or ambiguous redef
             for i, f in enumerate(fprev):
@@ -205,6 +283,15 @@ class SymbTable(Mash):
                         break
                 else:
                     fprev.append(irfun)
+            # Overloads are changed, so resolved calls have to be invalidated
+            Dispatch(fprev)
+
+    def dispatch_table(self, overloads):
+        d = overloads[0].dispatch
+        if d is None or d.overloads is not overloads:
+            # Function is also in other overload list
+            d = Dispatch(overloads)
+        return d
 
     def search_scope(self, symb, scope, write, ret_top=False):
         from mash_types import Class, Enum
@@ -222,7 +309,10 @@ class SymbTable(Mash):
         else:
             s = symb[0]
 
-        for f in reversed(scope):
+        top = None
+        for f in scope:
+            if top is None:
+                top = f
             if not issubclass(type(f), Frame) and type(f) != Class and type(f) != Enum:
                 return (f, symb)
             if s in f:
@@ -240,7 +330,7 @@ class SymbTable(Mash):
             if write and (obj_find or f.shadowing):
                 break
         if ret_top and len(symb) <= 2:
-            return scope[-1]
+            return top
         return None
 
     def search_scope_list(self, symb, scope, write):
@@ -259,7 +349,10 @@ class SymbTable(Mash):
         else:
             s = symb[0]
         
-        for f in reversed(scope):
+        top = None
+        for f in scope:
+            if top is None:
+                top = f
             if not issubclass(type(f), Frame) and type(f) != Class:
                 return [(f, symb)]
             if s in f:
@@ -276,9 +369,9 @@ class SymbTable(Mash):
                     return [f]+self.search_scope_list(symb[move_am:], [f[s]], write)
             if write and (obj_find or f.shadowing):
                 break
-        if type(scope[-1]) != list:
-            return [scope[-1]]
-        return scope[-1]
+        if type(top) != list:
+            return [top]
+        return top
 
     def get_frame(self, symb, write=False, ret_top=False, flist=False):
         if type(symb) != list:
@@ -290,15 +383,12 @@ class SymbTable(Mash):
             symb = symb[1::]
         elif symb[0] == "::":
             # Global var
-            scope = self.frames[0:1]
+            scope = [self.global_frame]
             if flist:
                 return self.search_scope_list(symb[1:], scope, write)
             return self.search_scope(symb[1:], scope, write, ret_top=ret_top)
 
-        if self.shadow_depth > 0 and write:
-            scope = self.frames[1:self.index+1]
-        else:
-            scope = self.frames[:self.index+1]
+        scope = self.chain(self.shadow_depth > 0 and write)
         if flist:
             return self.search_scope_list(symb, scope, write)
         return self.search_scope(symb, scope, write, ret_top=ret_top)
@@ -311,7 +401,8 @@ class SymbTable(Mash):
             if type(value) == str or (type(value) == list and len(value) > 0 and type(value[0]) == str):
                 # TODO: Make sure that Int, Float, String, Bool are copied
                 #       They should be, because Expr creates a new object
-                value = self.get(value)
+                from mash_types import share
+                value = share(self.get(value))
         obj_access = False
         if not self.analyzer and type(symb) == list and len(symb) > 2 and symb[-2] == ".":
             obj_access = True
@@ -368,8 +459,8 @@ class SymbTable(Mash):
 
     def __str__(self):
         ts = ["Symbolic table:"]
-        for c, x in enumerate(self.frames):
-            ts.append(("--> " if self.index == c else "") + str(c)+": {\n"+x.fstr(0)+"\n}")
+        for c, x in enumerate(reversed(list(self.chain()))):
+            ts.append(str(c)+": {\n"+x.fstr(0)+"\n}")
         ts.append("Spaces: "+str([x.name for x in self.spaces]))
         return "\n".join(ts)
 
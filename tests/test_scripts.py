@@ -0,0 +1,126 @@
+"""
+Runs Mash scripts in tests/scripts and compares their output
+with the expected one in the .out file of the same name.
+Scripts with an .err file are expected to fail with this error.
+Files ending with _mod.ms are modules imported by the scripts
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRIPTS = ROOT / "tests" / "scripts"
+
+def scripts():
+    return sorted(p for p in SCRIPTS.glob("*.ms") if not p.name.endswith("_mod.ms"))
+
+def run(script, *args, env=None):
+    return subprocess.run([sys.executable, str(ROOT / "mash.py"), *args, "-l", str(ROOT), "-l", str(SCRIPTS), script.name],
+                          capture_output=True, text=True, cwd=SCRIPTS, timeout=300, env=env)
+
+def check(script, r):
+    assert r.stdout == script.with_suffix(".out").read_text(encoding="utf-8")
+    err = script.with_suffix(".err")
+    if err.exists():
+        assert r.stderr == err.read_text(encoding="utf-8")
+        assert r.returncode == 1
+    else:
+        assert r.returncode == 0, r.stderr
+
+# Unoptimized code is run as it was generated and is never tiered up
+@pytest.mark.parametrize("level", ["-O0", "-O1", "-O2"])
+@pytest.mark.parametrize("script", scripts(), ids=lambda p: p.stem)
+def test_script(script, level):
+    check(script, run(script, "--no-cache", level))
+
+@pytest.mark.parametrize("level", ["-O3", "-O-1", "-Ox"])
+def test_invalid_level(level):
+    r = run(scripts()[0], level)
+    assert "argument -O: invalid" in r.stderr
+    assert r.returncode == 2
+
+def test_same_output_at_levels():
+    script = SCRIPTS / "numeric_types.ms"
+    outputs = [run(script, "--no-cache", *level) for level in [["-O", "0"], ["-O0"], ["-O1"], ["-O2"]]]
+    assert all((r.stdout, r.stderr) == (outputs[0].stdout, outputs[0].stderr) for r in outputs)
+
+@pytest.mark.parametrize("script", scripts(), ids=lambda p: p.stem)
+def test_cached(script, tmp_path):
+    cache = tmp_path / "mash-cache-v1"
+    cache.mkdir(mode=0o700)
+    # Entries of other interpreter versions are removed, other files are kept
+    (cache / "0123456789abcdef").mkdir()
+    (tmp_path / "0123456789abcdef").mkdir()
+    env = dict(os.environ, MASH_CACHE=str(tmp_path))
+    for _ in range(2):
+        check(script, run(script, env=env))
+    assert not (cache / "0123456789abcdef").exists()
+    assert (tmp_path / "0123456789abcdef").exists()
+    assert (cache / "CACHEDIR.TAG").exists()
+    assert any(cache.glob("*/*.main"))
+
+@pytest.mark.skipif(os.name != "posix", reason="Permissions are checked on POSIX only")
+def test_cache_permissions(tmp_path):
+    # Cache, which other users can write into, is not used
+    cache = tmp_path / "mash-cache-v1"
+    cache.mkdir()
+    cache.chmod(0o777)
+    script = scripts()[0]
+    check(script, run(script, env=dict(os.environ, MASH_CACHE=str(tmp_path))))
+    assert list(cache.iterdir()) == []
+
+# Counts constructions of the Lark parser while running mash.py
+COUNT_PARSERS = """
+import runpy, sys
+sys.path.insert(0, sys.argv[1])
+import mash_parser
+built = []
+load = mash_parser.Lark_StandAlone
+def counted(**kwargs):
+    built.append(kwargs)
+    return load(**kwargs)
+mash_parser.Lark_StandAlone = counted
+script = sys.argv[1] + "/mash.py"
+sys.argv = [script, *sys.argv[2:]]
+try:
+    runpy.run_path(script, run_name="__main__")
+finally:
+    print(f"parsers: {len(built)}", file=sys.stderr)
+"""
+
+def test_shared_parser():
+    # Script, libmash and the imported module are parsed with one parser
+    script = SCRIPTS / "t13_import.ms"
+    r = subprocess.run([sys.executable, "-c", COUNT_PARSERS, str(ROOT), "--no-cache", "-l", str(ROOT), "-l", str(SCRIPTS), script.name],
+                       capture_output=True, text=True, cwd=SCRIPTS, timeout=300)
+    assert r.stdout == script.with_suffix(".out").read_text(encoding="utf-8")
+    assert r.stderr.splitlines()[-1] == "parsers: 1"
+
+# Type errors of operations run whenever the code is are reported before
+# the code is run, -s only generates and optimizes the code
+STATIC_ERRORS = [
+    (["-s"], 'x = "a" - 1', "Unsupported types for '-'. Operands are always of types 'String' and 'Int'"),
+    (["-s"], 'x = "a"\ny = -x', "Unsupported type for '-'. Operand is always of type 'String'"),
+    (["-s"], 'x = "a"\nwhile(x) {\n}', "Unexpected expression type 'String' in while statement condition"),
+    ([], 'fun g() {\n    x = "a" - 1\n}\ng()', "Unsupported types for '-'. Operands are always of types 'String' and 'Int'"),
+    # Operations, which may not be run
+    (["-s"], 'c = 1 > 2\nif(c) {\n    x = "a" - 1\n}', None),
+    (["-s"], 'while(true) {\n}\nx = "a" - 1', None),
+    (["-s"], 'print(1)\nx = "a" - 1', None),
+    ([], 'fun f() {\n    return 1\n    x = "a" - 1\n}\ny = f()', None),
+    ([], 'fun f(c) {\n    if(c) return 1\n    x = "a" - 1\n}\ny = f(true)', None),
+]
+
+@pytest.mark.parametrize("args, code, error", STATIC_ERRORS)
+def test_static_error(args, code, error, tmp_path):
+    script = tmp_path / "static.ms"
+    script.write_text(code+"\n", encoding="utf-8")
+    r = subprocess.run([sys.executable, str(ROOT / "mash.py"), "--no-cache", *args, "-l", str(ROOT), script.name],
+                       capture_output=True, text=True, cwd=tmp_path, timeout=300)
+    if error is None:
+        assert r.returncode == 0, r.stderr
+    else:
+        assert r.stderr == f"static.ms: Error: Type error: {error}.\n"
+        assert r.returncode == 1
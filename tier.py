@@ -0,0 +1,209 @@
+"""
+Translation of lowered function bodies into Python functions
+"""
+import operator
+from ir import (AssignVar, Expr, UnExpr, Jump, JumpIfNot, JumpIf, JumpIfFalsy, Return,
+                PushFrame, PopFrame, successors, wrap)
+from symbol_table import symb_table
+from mash_types import Value, Int, Float, Bool, share
+
+# Python operators for operations on known numeric types
+OPERATORS = {
+    operator.add: "+",
+    operator.sub: "-",
+    operator.mul: "*",
+    operator.truediv: "/",
+    operator.floordiv: "//",
+    operator.mod: "%",
+    operator.pow: "**",
+    operator.lt: "<",
+    operator.le: "<=",
+    operator.gt: ">",
+    operator.ge: ">=",
+    operator.eq: "==",
+    operator.ne: "!=",
+    operator.neg: "-",
+}
+
+class Translation:
+    """
+    Python source of one function body with objects it refers to
+    """
+    def __init__(self, lw, compiled):
+        self.lw = lw
+        self.compiled = compiled
+        self.lines = []
+        self.names = {
+            "st": symb_table,
+            "get": symb_table.get,
+            "assign": symb_table.assign,
+            "wrap": wrap,
+            "share": share,
+            "Int": Int,
+            "Float": Float,
+            "Bool": Bool,
+        }
+
+    def emit(self, line, indent=3):
+        self.lines.append("    "*indent+line)
+
+    def ref(self, obj, prefix):
+        """
+        Makes object accessible from the source
+        @return Name of the object in the source
+        """
+        name = f"{prefix}{len(self.names)}"
+        self.names[name] = obj
+        return name
+
+    def read(self, pc, name):
+        """
+        @return Expression reading value of operand
+        """
+        inst = self.lw.code[pc]
+        if issubclass(type(name), Value):
+            return self.ref(name, "k")
+        if type(name) != str:
+            return f"get({self.ref(name, 'n')})"
+        if inst.regs is not None and name in inst.regs:
+            return f"regs[{inst.regs[name]}]"
+        if inst.depths is not None and name in inst.depths:
+            f = f"f{self.lw.depths[pc]-inst.depths[name]}"
+            return f"({f}[{name!r}] if {name!r} in {f} else get({name!r}))"
+        return f"get({name!r})"
+
+    def write(self, pc, name, value):
+        """
+        Emits assignment of value, which is never a name, into operand
+        """
+        inst = self.lw.code[pc]
+        if type(name) == str and inst.regs is not None and name in inst.regs:
+            self.emit(f"regs[{inst.regs[name]}] = {value}")
+        elif type(name) == str and inst.depths is not None and name in inst.depths:
+            self.emit(f"f{self.lw.depths[pc]-inst.depths[name]}[{name!r}] = {value}")
+        else:
+            self.emit(f"assign({self.ref(name, 'n')}, {value})")
+
+    def jump(self, target):
+        self.emit(f"pc = {target}")
+        self.emit("continue")
+
+    def instruction(self, pc):
+        """
+        Emits source for instruction
+        @return False if instruction cannot be translated
+        """
+        inst = self.lw.code[pc]
+        t = type(inst)
+        if t == AssignVar and not inst.skip and (type(inst.value) == str or (
+                issubclass(type(inst.value), Value) and type(inst.value).update is Value.update)):
+            value = self.read(pc, inst.value)
+            if type(inst.value) == str:
+                value = f"share({value})"
+            self.write(pc, inst.dst, value)
+        elif issubclass(t, Expr) and inst.known is not None and type(inst).FAST in OPERATORS:
+            op = OPERATORS[type(inst).FAST]
+            make = self.ref(inst.known[-1] or wrap, "t")
+            fallback = self.ref(inst.eval, "e")
+            if issubclass(t, UnExpr):
+                self.emit(f"a = {self.read(pc, inst.src1)}")
+                operands = "a"
+                value = f"{op}a.value"
+            else:
+                self.emit(f"a = {self.read(pc, inst.src1)}")
+                self.emit(f"b = {self.read(pc, inst.src2)}")
+                operands = "a, b"
+                value = f"a.value {op} b.value"
+            self.emit("try:")
+            self.emit(f"    v = {make}({value})")
+            self.emit("except Exception:")
+            self.emit("    # Error is raised by the general evaluation")
+            self.emit(f"    v = {fallback}({operands})")
+            self.write(pc, inst.dst, "v")
+        elif t in {JumpIfNot, JumpIf, JumpIfFalsy}:
+            if inst.known is Bool:
+                cnd = f"{self.read(pc, inst.cnd)}.value"
+            else:
+                cnd = f"{self.ref(inst.check, 'e')}({self.read(pc, inst.cnd)})"
+            self.emit(f"if {cnd}:" if t == JumpIf else f"if not {cnd}:")
+            self.emit(f"    pc = {inst.target}")
+            self.emit("    continue")
+        elif t == Jump:
+            if inst.pops > 0:
+                self.emit(f"st.pop({inst.pops})")
+            self.jump(inst.target)
+        elif t == Return:
+            self.emit(f"v = {self.read(pc, inst.value)}")
+            self.emit("v.update()")
+            self.emit(f"return v, {inst.frames}")
+        elif t == PushFrame:
+            self.emit("st.push()")
+            self.emit(f"f{self.lw.depths[pc]+1} = st.top_frame")
+        elif t == PopFrame:
+            self.emit("st.pop()")
+        else:
+            nxt = successors(inst, pc)
+            if len(nxt) == 0 or nxt[0] != pc+1 or len(nxt) > 2:
+                return False
+            closure = self.ref(self.compiled[pc], "c")
+            if len(nxt) == 1:
+                self.emit(f"{closure}()")
+            else:
+                # Conditional jump, which returns its target when taken
+                self.emit(f"if {closure}() is not None:")
+                self.emit(f"    pc = {nxt[1]}")
+                self.emit("    continue")
+        return True
+
+    def source(self, name):
+        """
+        @return Source of the whole function or None if it cannot be translated
+        """
+        code = self.lw.code
+        self.emit(f"def {name}():", 0)
+        if len(code) == 0:
+            self.emit("return None", 1)
+            return "\n".join(self.lines)+"\n"
+        leaders = {0}
+        for pc, inst in enumerate(code):
+            nxt = successors(inst, pc)
+            if nxt != [pc+1]:
+                leaders.add(pc+1)
+                leaders.update(nxt)
+        leaders = sorted(l for l in leaders if l < len(code))
+        self.emit("regs = st.regs", 1)
+        self.emit("f0 = st.top_frame", 1)
+        self.emit("pc = 0", 1)
+        self.emit("while True:", 1)
+        for i, start in enumerate(leaders):
+            end = leaders[i+1] if i+1 < len(leaders) else len(code)
+            self.emit(("if" if i == 0 else "elif")+f" pc == {start}:", 2)
+            for pc in range(start, end):
+                if not self.instruction(pc):
+                    return None
+            nxt = successors(code[end-1], end-1)
+            if len(nxt) > 0 and nxt[0] == end:
+                if end >= len(code):
+                    self.emit("return None")
+                else:
+                    self.jump(end)
+        self.emit("else:", 2)
+        self.emit("return None", 3)
+        return "\n".join(self.lines)+"\n"
+
+def translate(lw, compiled, name):
+    """
+    Translates lowered function body into Python function
+    @param lw Lowering with the body
+    @param compiled Compiled instructions of the body, used for instructions
+                    which are not translated
+    @param name Name of the function
+    @return Function running the body or None if it cannot be translated
+    """
+    t = Translation(lw, compiled)
+    src = t.source("body")
+    if src is None:
+        return None
+    code = compile(src, f"<mash fun {name}>", "exec")
+    exec(code, t.names)
+    return t.names["body"]